@@ -0,0 +1,105 @@
+"""An asynchronous downloader and cache for Discord user avatars."""
+import asyncio
+import collections
+import os
+from io import BytesIO
+
+import discord
+from PIL import Image
+
+from http_client import HttpClient
+
+
+def _decode(data: bytes, size: int):
+    avatar = Image.open(BytesIO(data)).convert(mode="RGBA")
+    return avatar.resize((size, size), Image.LANCZOS).tobytes()
+
+
+class AvatarFetcher:
+    """
+    Downloads user avatars and resizes them to the size they are drawn at,
+    designed for use with PhotonBot. Avatars are returned as raw RGBA data,
+    ready to be passed to the functions in `rendering`. Resized avatars are
+    kept in memory by the hash of the avatar and their size, with the least
+    recently used ones being removed after `max_entries`. If `directory` is
+    given, they are also saved there so that they survive restarts. An avatar
+    is only downloaded again once the user changes it. Downloads are sent
+    through `http_client`, which is normally the bot's shared client.
+    """
+    def __init__(self, http_client: HttpClient, max_entries: int = 512,
+            directory: str = None):
+        """Create an empty cache."""
+        self.http_client = http_client
+        self.max_entries = max_entries
+        self.directory = directory or None
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+        self._entries = collections.OrderedDict()
+        self._hits = 0
+        self._disk_hits = 0
+        self._downloads = 0
+
+    async def get(self, user: discord.abc.User, size: int):
+        """
+        Get the avatar currently shown for a user, resized to `size` by
+        `size` pixels, as raw RGBA data.
+        """
+        asset = user.display_avatar
+        key = (asset.key, size)
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return data
+        loop = asyncio.get_running_loop()
+        if self.directory is not None:
+            data = await loop.run_in_executor(None, self._read_file, key)
+        if data is not None:
+            self._disk_hits += 1
+        else:
+            # Download the smallest size from the CDN that is large enough
+            cdn_size = max(1 << (size - 1).bit_length(), 16)
+            url = asset.with_static_format("png").with_size(cdn_size).url
+            downloaded = await self.http_client.get_bytes(
+                url, raise_for_status=True
+            )
+            self._downloads += 1
+            data = await loop.run_in_executor(None, _decode, downloaded, size)
+            if self.directory is not None:
+                await loop.run_in_executor(None, self._write_file, key, data)
+        self._entries[key] = data
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return data
+
+    def _file_path(self, key: tuple):
+        return os.path.join(self.directory, f"{key[0]}-{key[1]}.rgba")
+
+    def _read_file(self, key: tuple):
+        try:
+            with open(self._file_path(key), "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        # Ignore files that were only partly written
+        if len(data) != key[1] * key[1] * 4:
+            return None
+        return data
+
+    def _write_file(self, key: tuple, data: bytes):
+        path = self._file_path(key)
+        try:
+            with open(path + ".tmp", "wb") as file:
+                file.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError as error:
+            print(f"Failed to save avatar to disk: {error}")
+
+    def stats(self):
+        """Get the number of cached avatars and how often they were reused."""
+        return {
+            "entries": len(self._entries),
+            "hits": self._hits,
+            "disk_hits": self._disk_hits,
+            "downloads": self._downloads
+        }
@@ -0,0 +1,117 @@
+"""
+Measure how many messages per second can be granted EXP with a database
+backend, both by writing every grant to the database as it happens and by
+accumulating grants in `utils.ExpLedger` and flushing them in bulk.
+
+Usage:
+    python benchmarks/exp_throughput.py sqlite
+    python benchmarks/exp_throughput.py mariadb --config path/to/config.ini
+
+With `sqlite`, a temporary database is used unless a config file is given.
+With `mariadb`, the `DatabaseConnection` section of the config file is used,
+and every row written is removed again afterwards.
+"""
+import argparse
+import asyncio
+import configparser
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+
+# A guild ID that will never belong to a real guild
+GUILD_ID = 1
+
+
+def get_database_config(backend: str, config_path: str):
+    config = configparser.ConfigParser(
+        interpolation=configparser.BasicInterpolation()
+    )
+    if config_path is not None:
+        config.read(config_path)
+    elif backend == "sqlite":
+        config.read_dict({"DatabaseConnection": {
+            "Path": os.path.join(tempfile.mkdtemp(), "benchmark.db")
+        }})
+    else:
+        raise SystemExit("A config file is required for the mariadb backend")
+    config['DatabaseConnection']['Backend'] = backend
+    return config['DatabaseConnection']
+
+
+async def per_message(database_config, messages: list):
+    for user_id, amount in messages:
+        async with utils.AsyncDatabase(database_config) as database:
+            await database.upsert(
+                "user_exp", {"guild_id": GUILD_ID, "user_id": user_id},
+                {"exp": amount}, increment=True
+            )
+
+
+async def ledger(database_config, messages: list, flush_every: int):
+    exp_ledger = utils.ExpLedger(database_config)
+    for index, (user_id, amount) in enumerate(messages, 1):
+        await exp_ledger.grant(GUILD_ID, user_id, amount)
+        if index % flush_every == 0:
+            await exp_ledger.flush()
+    await exp_ledger.flush()
+
+
+async def clear(database_config):
+    async with utils.AsyncDatabase(database_config) as database:
+        await database.modify(
+            "DELETE FROM user_exp WHERE guild_id = %s;", (GUILD_ID,)
+        )
+
+
+async def run(args):
+    database_config = get_database_config(args.backend, args.config)
+    utils.run_migrations(
+        database_config, "core",
+        os.path.join(os.path.dirname(utils.__file__), "migrations")
+    )
+    messages = [
+        (random.randint(1, args.users), random.randint(15, 25))
+        for _ in range(args.messages)
+    ]
+    print(
+        f"{args.messages} messages from {args.users} users "
+        + f"on {args.backend}"
+    )
+    for name, benchmark in (
+            ("Per-message upsert", per_message(database_config, messages)),
+            ("EXP ledger", ledger(
+                database_config, messages, args.flush_every
+            ))):
+        await clear(database_config)
+        start_time = time.perf_counter()
+        await benchmark
+        elapsed = time.perf_counter() - start_time
+        print(
+            f"{name}: {elapsed:.3f}s, "
+            + f"{args.messages / elapsed:,.0f} messages per second"
+        )
+    await clear(database_config)
+    utils.get_pool(database_config).close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("backend", choices=sorted(utils.BACKENDS))
+    parser.add_argument("--config", help="config file to connect with")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument(
+        "--flush-every", type=int, default=1000,
+        help="messages between ledger flushes"
+    )
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
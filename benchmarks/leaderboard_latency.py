@@ -0,0 +1,143 @@
+"""
+Measure how long it takes to draw a full leaderboard with cold caches, with
+user lookups and avatar downloads served by a local HTTP stub that adds a
+fixed latency to every request. Rows are resolved one at a time, then
+concurrently under a semaphore as `/leaderboard` does, and the concurrent time
+is checked against a target of one second.
+
+Usage:
+    python benchmarks/leaderboard_latency.py [--latency 0.1] [--concurrency 5]
+
+The render worker processes are started before timing begins, as they are
+started once when the bot loads the ranking plugin.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import types
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import avatars
+import http_client
+import rendering
+
+HOST = "127.0.0.1"
+# The top 5 users are drawn in full and the next 10 as avatars only
+ROW_COUNT = 15
+TARGET_SECONDS = 1.0
+
+
+class StubAsset:
+    """Stands in for `discord.Asset`, pointing at the stub server."""
+    def __init__(self, base_url: str, key: str):
+        self.key = key
+        self._base_url = base_url
+
+    def with_static_format(self, _):
+        return self
+
+    def with_size(self, _):
+        return self
+
+    @property
+    def url(self):
+        return f"{self._base_url}/avatars/{self.key}.png"
+
+
+async def start_stub(latency: float, port: int):
+    avatar = BytesIO()
+    Image.new("RGB", (128, 128), (200, 10, 10)).save(avatar, "PNG")
+    avatar = avatar.getvalue()
+
+    async def get_user(request: web.Request):
+        await asyncio.sleep(latency)
+        return web.json_response({
+            "id": request.match_info["user_id"], "username": "User"
+        })
+
+    async def get_avatar(_):
+        await asyncio.sleep(latency)
+        return web.Response(body=avatar, content_type="image/png")
+
+    app = web.Application()
+    app.router.add_get("/users/{user_id}", get_user)
+    app.router.add_get("/avatars/{key}", get_avatar)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, port).start()
+    return runner
+
+
+async def draw_board(base_url: str, client: http_client.HttpClient,
+        renderer: rendering.Renderer, concurrency: int):
+    # Every board starts with empty caches
+    avatar_fetcher = avatars.AvatarFetcher(client)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def resolve(user_id: int):
+        async with semaphore:
+            user_data = await client.get_json(f"{base_url}/users/{user_id}")
+            user = types.SimpleNamespace(
+                name=user_data["username"],
+                display_avatar=StubAsset(base_url, str(user_id))
+            )
+            avatar = await avatar_fetcher.get(
+                user, rendering.LEADERBOARD_AVATAR_SIZE
+            )
+        return user, avatar
+
+    start_time = time.perf_counter()
+    rows = await asyncio.gather(*(resolve(x) for x in range(ROW_COUNT)))
+    await renderer.leaderboard(
+        [(avatar, user.name, 1000, 5) for user, avatar in rows[:5]],
+        [avatar for _, avatar in rows[5:]]
+    )
+    return time.perf_counter() - start_time
+
+
+async def run(args):
+    base_url = f"http://{HOST}:{args.port}"
+    runner = await start_stub(args.latency, args.port)
+    client = http_client.HttpClient()
+    renderer = rendering.Renderer()
+    blank_avatar = bytes(rendering.LEADERBOARD_AVATAR_SIZE ** 2 * 4)
+    await renderer.leaderboard([(blank_avatar, "", 0, 0)], [])
+    print(
+        f"{ROW_COUNT} rows, {args.latency * 1000:.0f}ms latency "
+        + "per request"
+    )
+    try:
+        serial = await draw_board(base_url, client, renderer, 1)
+        print(f"One row at a time: {serial:.2f}s")
+        concurrent = await draw_board(
+            base_url, client, renderer, args.concurrency
+        )
+        print(f"{args.concurrency} rows at a time: {concurrent:.2f}s")
+    finally:
+        renderer.close()
+        await client.close()
+        await runner.cleanup()
+    if concurrent >= TARGET_SECONDS:
+        print(f"Slower than the {TARGET_SECONDS:.0f}s target")
+        return 1
+    print(f"Within the {TARGET_SECONDS:.0f}s target")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
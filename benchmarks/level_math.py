@@ -0,0 +1,84 @@
+"""
+Compare the level calculations in `utils` with the loop-based versions they
+replaced, checking first that both give the same results.
+
+Usage:
+    python benchmarks/level_math.py [--values 10000] [--max-exp 5000000]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+
+
+def loop_calculate_level(exp: int):
+    remainder = exp
+    level = 0
+    while remainder >= utils.single_level_exp(level + 1):
+        level += 1
+        remainder -= utils.single_level_exp(level)
+    return level, remainder
+
+
+def loop_total_exp_for_level(level: int):
+    return sum(utils.single_level_exp(x) for x in range(1, level + 1))
+
+
+def report(name: str, baseline, optimised, count: int):
+    baseline_time = min(timeit.repeat(baseline, number=1, repeat=3))
+    optimised_time = min(timeit.repeat(optimised, number=1, repeat=3))
+    print(
+        f"{name}: {baseline_time / count * 1e6:.2f}us -> "
+        + f"{optimised_time / count * 1e6:.2f}us per value "
+        + f"({baseline_time / optimised_time:,.0f}x faster)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--values", type=int, default=10000)
+    parser.add_argument("--max-exp", type=int, default=5000000)
+    args = parser.parse_args()
+    exps = [random.randint(0, args.max_exp) for _ in range(args.values)]
+    levels = [utils.calculate_level(x)[0] for x in exps]
+
+    for exp, level in zip(exps, levels):
+        assert utils.calculate_level(exp) == loop_calculate_level(exp)
+        assert (utils.total_exp_for_level(level)
+            == loop_total_exp_for_level(level))
+    batch_levels, batch_remaining = utils.calculate_levels(exps)
+    assert batch_levels.tolist() == levels
+    assert batch_remaining.tolist() == [
+        utils.calculate_level(x)[1] for x in exps
+    ]
+
+    print(f"{args.values} values with up to {args.max_exp} EXP")
+    report(
+        "calculate_level",
+        lambda: [loop_calculate_level(x) for x in exps],
+        lambda: [utils.calculate_level(x) for x in exps], args.values
+    )
+    report(
+        "total_exp_for_level",
+        lambda: [loop_total_exp_for_level(x) for x in levels],
+        lambda: [utils.total_exp_for_level(x) for x in levels], args.values
+    )
+    report(
+        "calculate_levels (batch)",
+        lambda: [loop_calculate_level(x) for x in exps],
+        lambda: utils.calculate_levels(exps), args.values
+    )
+    report(
+        "total_exp_for_levels (batch)",
+        lambda: [loop_total_exp_for_level(x) for x in levels],
+        lambda: utils.total_exp_for_levels(levels), args.values
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,34 @@ CREATE TABLE IF NOT EXISTS `guild_config` (
 );
 
 CREATE TABLE IF NOT EXISTS `reminders` (
+  `id` bigint(20) unsigned NOT NULL AUTO_INCREMENT,
   `due_datetime` datetime NOT NULL,
   `user_id` bigint(20) NOT NULL,
-  `content` text NOT NULL
+  `content` text NOT NULL,
+  `attempts` int(11) NOT NULL DEFAULT 0,
+  `lease_owner` char(36) DEFAULT NULL,
+  `lease_expires` datetime DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `reminders_due_datetime` (`due_datetime`),
+  KEY `reminders_user_id_due_datetime` (`user_id`, `due_datetime`)
+);
+
+CREATE TABLE IF NOT EXISTS `reminders_dead_letter` (
+  `id` bigint(20) unsigned NOT NULL,
+  `due_datetime` datetime NOT NULL,
+  `user_id` bigint(20) NOT NULL,
+  `content` text NOT NULL,
+  `attempts` int(11) NOT NULL,
+  `failed_datetime` datetime NOT NULL,
+  PRIMARY KEY (`id`)
 );
 
 CREATE TABLE IF NOT EXISTS `user_exp` (
   `guild_id` bigint(20) NOT NULL,
   `user_id` bigint(20) NOT NULL,
   `exp` bigint(20) NOT NULL DEFAULT 0,
-  PRIMARY KEY (`guild_id`,`user_id`)
+  PRIMARY KEY (`guild_id`,`user_id`),
+  KEY `user_exp_guild_id_exp` (`guild_id`, `exp`)
 );
 
 CREATE TABLE IF NOT EXISTS `user_exp_card` (
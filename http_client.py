@@ -0,0 +1,319 @@
+"""
+A shared asynchronous HTTP client for requests to third-party APIs, along with
+per-provider rate limiting and circuit breaking.
+"""
+import asyncio
+import time
+
+import aiohttp
+
+
+class ProviderUnavailable(Exception):
+    """
+    Raised instead of a response when a third-party API could not be used,
+    either because it failed to respond, is being rate limited, or has
+    failed too often recently to be tried again yet.
+    """
+    def __init__(self, provider: str, reason: str):
+        super().__init__(f"{provider} is unavailable: {reason}")
+        self.provider = provider
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    Allows actions at an average of `rate` per second, with bursts of up to
+    `capacity` at once. A rate of 0 or less allows every action.
+    """
+    def __init__(self, rate: float, capacity: float):
+        """Create a bucket that starts full."""
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def try_acquire(self):
+        """Take a token if one is available and return whether one was."""
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class CircuitBreaker:
+    """
+    Stops calls to something that keeps failing. After `failure_threshold`
+    failures in a row the circuit opens and every call is refused for
+    `recovery_time` seconds. After that, a single trial call is allowed
+    through. The circuit closes again if it succeeds, or stays open for
+    another `recovery_time` seconds if it fails.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 5,
+            recovery_time: float = 30.0):
+        """Create a closed circuit."""
+        self.failure_threshold = max(failure_threshold, 1)
+        self.recovery_time = recovery_time
+        self._failures = 0
+        self._open_until = None
+        self._trial_running = False
+        self._trips = 0
+
+    @property
+    def state(self):
+        """Whether the circuit is closed, open or half-open."""
+        if self._open_until is None:
+            return self.CLOSED
+        if time.monotonic() < self._open_until:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self):
+        """
+        Return whether a call may be made now. If it may, the result of the
+        call must be given to `record_success`, `record_failure` or `release`.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def release(self):
+        """Allow another trial call after one finished without a result."""
+        self._trial_running = False
+
+    def record_success(self):
+        """Record that a call succeeded, closing the circuit."""
+        self._failures = 0
+        self._open_until = None
+        self._trial_running = False
+
+    def record_failure(self):
+        """Record that a call failed, opening the circuit if needed."""
+        self._failures += 1
+        if (self._trial_running
+                or self._failures >= self.failure_threshold):
+            self.trip()
+
+    def trip(self, duration: float = None):
+        """
+        Open the circuit for `duration` seconds, defaulting to
+        `recovery_time`.
+        """
+        if duration is None:
+            duration = self.recovery_time
+        self._open_until = time.monotonic() + duration
+        self._trial_running = False
+        self._trips += 1
+
+    @property
+    def trips(self):
+        """The number of times the circuit has been opened."""
+        return self._trips
+
+
+class ApiProvider:
+    """
+    A third-party API that requests are rate limited by a `TokenBucket` and
+    protected by a `CircuitBreaker` for. `rate_limit` is the average number
+    of requests allowed per minute, with bursts of up to `burst`. Any failure
+    is raised as `ProviderUnavailable`, and a response with the 429 status
+    code opens the circuit immediately, for as long as the provider asks if
+    it gives a `Retry-After` header.
+    """
+    def __init__(self, name: str, rate_limit: float = 60.0, burst: int = 10,
+            failure_threshold: int = 5, recovery_time: float = 30.0):
+        """Create a healthy provider with a full token bucket."""
+        self.name = name
+        self.bucket = TokenBucket(rate_limit / 60, burst)
+        self.breaker = CircuitBreaker(failure_threshold, recovery_time)
+        self._requests = 0
+        self._failures = 0
+        self._rate_limited = 0
+        self._rejected = 0
+
+    async def run(self, fetch):
+        """
+        Await `fetch()` and return its result if the provider is healthy and
+        a request is allowed by the rate limit, otherwise raise
+        `ProviderUnavailable` without calling it.
+        """
+        if not self.breaker.allow():
+            self._rejected += 1
+            raise ProviderUnavailable(self.name, "too many recent failures")
+        if not self.bucket.try_acquire():
+            self.breaker.release()
+            self._rate_limited += 1
+            raise ProviderUnavailable(self.name, "rate limited")
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as error:
+            self._failures += 1
+            if (isinstance(error, aiohttp.ClientResponseError)
+                    and error.status == 429):
+                self.breaker.trip(_retry_after(error))
+                raise ProviderUnavailable(
+                    self.name, "rate limited by provider"
+                ) from error
+            self.breaker.record_failure()
+            raise ProviderUnavailable(self.name, str(error)) from error
+        self._requests += 1
+        self.breaker.record_success()
+        return result
+
+    def stats(self):
+        """Get the health of the provider and how many requests it refused."""
+        return {
+            "state": self.breaker.state,
+            "requests": self._requests,
+            "failures": self._failures,
+            "circuit_trips": self.breaker.trips,
+            "rejected_unhealthy": self._rejected,
+            "rejected_rate_limited": self._rate_limited
+        }
+
+
+def _retry_after(error: aiohttp.ClientResponseError):
+    try:
+        return float(error.headers["Retry-After"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class HttpClient:
+    """
+    Sends HTTP requests without blocking the event loop, designed for use with
+    PhotonBot. A single session is shared by every plugin so that connections
+    are kept alive and reused between requests, with at most
+    `connections_per_host` open to any one host at a time. Requests that take
+    longer than `timeout` seconds in total raise `asyncio.TimeoutError`.
+
+    Like the `requests` library, responses are returned whatever their status
+    code unless `raise_for_status` is set, as many APIs describe their errors
+    in the body of the response. The exceptions are rate limiting (429) and
+    server errors (5xx), which always raise `aiohttp.ClientResponseError` as
+    their body is never a real answer and must not be cached.
+
+    Third-party APIs can be registered with `add_provider`. Requests made
+    with the name of a provider go through its `ApiProvider`, so raise
+    `ProviderUnavailable` instead of any other error.
+    """
+    def __init__(self, connections_per_host: int = 10, timeout: float = 10.0):
+        """Create a client with a session that is opened when needed."""
+        self.connections_per_host = connections_per_host
+        self.timeout = timeout
+        self.providers = {}
+        self._session = None
+        self._pending = 0
+        self._requests = 0
+        self._failures = 0
+        self._total_response_time = 0.0
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=self.connections_per_host,
+                    ttl_dns_cache=300
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    def add_provider(self, provider: ApiProvider):
+        """Register a third-party API that requests can be made through."""
+        self.providers[provider.name] = provider
+
+    async def _request(self, url: str, read, params: dict = None,
+            headers: dict = None, raise_for_status: bool = False,
+            provider: str = None):
+        if provider is not None:
+            return await self.providers[provider].run(
+                lambda: self._request(
+                    url, read, params, headers, raise_for_status
+                )
+            )
+        self._pending += 1
+        start_time = time.monotonic()
+        try:
+            async with self._get_session().get(
+                    url, params=params, headers=headers) as response:
+                if (raise_for_status or response.status == 429
+                        or response.status >= 500):
+                    response.raise_for_status()
+                result = await read(response)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self._failures += 1
+            raise
+        finally:
+            self._pending -= 1
+        self._requests += 1
+        self._total_response_time += time.monotonic() - start_time
+        return result
+
+    async def get_json(self, url: str, params: dict = None,
+            headers: dict = None, raise_for_status: bool = False,
+            provider: str = None, with_status: bool = False):
+        """
+        Send a GET request and decode the body of the response as JSON,
+        regardless of the content type the server gives it. If `with_status`
+        is set, a tuple of the status code and the decoded body is returned.
+        """
+        async def read(response: aiohttp.ClientResponse):
+            body = await response.json(content_type=None)
+            return (response.status, body) if with_status else body
+        return await self._request(
+            url, read, params, headers, raise_for_status, provider
+        )
+
+    async def get_text(self, url: str, params: dict = None,
+            headers: dict = None, raise_for_status: bool = False,
+            provider: str = None):
+        """Send a GET request and decode the body of the response as text."""
+        return await self._request(
+            url, lambda x: x.text(), params, headers, raise_for_status,
+            provider
+        )
+
+    async def get_bytes(self, url: str, params: dict = None,
+            headers: dict = None, raise_for_status: bool = False,
+            provider: str = None):
+        """Send a GET request and return the body of the response."""
+        return await self._request(
+            url, lambda x: x.read(), params, headers, raise_for_status,
+            provider
+        )
+
+    def stats(self):
+        """
+        Get the number of requests sent and how long responses took, in
+        seconds.
+        """
+        return {
+            "in_progress": self._pending,
+            "requests": self._requests,
+            "failures": self._failures,
+            "average_response_time": self._total_response_time
+            / self._requests if self._requests else 0.0
+        }
+
+    async def close(self):
+        """Close the session and every connection it has open."""
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,8 @@
+CREATE INDEX IF NOT EXISTS `user_exp_guild_id_exp`
+  ON `user_exp` (`guild_id`, `exp`);
+
+CREATE INDEX IF NOT EXISTS `reminders_due_datetime`
+  ON `reminders` (`due_datetime`);
+
+CREATE INDEX IF NOT EXISTS `reminders_user_id_due_datetime`
+  ON `reminders` (`user_id`, `due_datetime`);
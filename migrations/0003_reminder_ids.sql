@@ -0,0 +1,3 @@
+ALTER TABLE `reminders`
+  ADD COLUMN IF NOT EXISTS `id` bigint(20) unsigned NOT NULL AUTO_INCREMENT
+  PRIMARY KEY FIRST;
@@ -0,0 +1,12 @@
+ALTER TABLE `reminders`
+  ADD COLUMN IF NOT EXISTS `attempts` int(11) NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS `reminders_dead_letter` (
+  `id` bigint(20) unsigned NOT NULL,
+  `due_datetime` datetime NOT NULL,
+  `user_id` bigint(20) NOT NULL,
+  `content` text NOT NULL,
+  `attempts` int(11) NOT NULL,
+  `failed_datetime` datetime NOT NULL,
+  PRIMARY KEY (`id`)
+);
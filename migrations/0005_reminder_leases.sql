@@ -0,0 +1,3 @@
+ALTER TABLE `reminders`
+  ADD COLUMN IF NOT EXISTS `lease_owner` char(36) DEFAULT NULL,
+  ADD COLUMN IF NOT EXISTS `lease_expires` datetime DEFAULT NULL;
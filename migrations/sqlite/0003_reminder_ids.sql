@@ -0,0 +1,21 @@
+-- SQLite cannot add a primary key to an existing table, so it is rebuilt
+CREATE TABLE `reminders_new` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `due_datetime` datetime NOT NULL,
+  `user_id` bigint(20) NOT NULL,
+  `content` text NOT NULL
+);
+
+INSERT INTO `reminders_new` (`due_datetime`, `user_id`, `content`)
+  SELECT `due_datetime`, `user_id`, `content` FROM `reminders`
+  ORDER BY `due_datetime`;
+
+DROP TABLE `reminders`;
+
+ALTER TABLE `reminders_new` RENAME TO `reminders`;
+
+CREATE INDEX `reminders_due_datetime`
+  ON `reminders` (`due_datetime`);
+
+CREATE INDEX `reminders_user_id_due_datetime`
+  ON `reminders` (`user_id`, `due_datetime`);
@@ -0,0 +1,5 @@
+ALTER TABLE `reminders`
+  ADD COLUMN `lease_owner` char(36) DEFAULT NULL;
+
+ALTER TABLE `reminders`
+  ADD COLUMN `lease_expires` datetime DEFAULT NULL;
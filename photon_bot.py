@@ -1,13 +1,20 @@
 """
 An easily expandable Discord Bot written in Python 3 using the pycord library.
 """
+import asyncio
 import configparser
 import importlib
 import os
+import signal
+import sys
+import traceback
 
 import discord
 from discord.flags import Intents
 
+import http_client
+import utils
+
 
 class plugin_types:
     """
@@ -22,9 +29,12 @@ class PhotonBot:
     """
     Represents a Discord bot being handled by the Photon Bot Framework.
     The `discord.Bot` instance itself can be found under `discord_bot`,
-    the loaded config file under `config` and the bot's starting datetime under
-    `start_time`. The bot will automatically load plugins specified in config
-    file when an instance is created.
+    the loaded config file under `config`, the bot's starting datetime under
+    `start_time`, the shared database connection pool under `database_pool`,
+    the cache of guild configurations under `guild_config_cache`, the
+    ledger of user EXP under `exp_ledger` and the shared HTTP client under
+    `http_client`. The bot will automatically load plugins specified in
+    config file when an instance is created.
     """
     __version__ = "1.0.0"
 
@@ -53,7 +63,37 @@ class PhotonBot:
         self.config.read(config_path)
         self.directory_location = os.path.dirname(__file__)
         self.variables = {}
+        self.metrics = {}
+        self.shutdown_hooks = []
+        self.migrations = []
         self.start_time = None
+        self.database_pool = utils.get_pool(self.config['DatabaseConnection'])
+        self.guild_config_cache = utils.GuildConfigCache(
+            self.config['DatabaseConnection'],
+            self.config.getfloat(
+                'Performance', 'GuildConfigCacheTTL', fallback=300.0
+            )
+        )
+        self.exp_ledger = utils.ExpLedger(self.config['DatabaseConnection'])
+        self.http_client = http_client.HttpClient(
+            self.config.getint(
+                'Performance', 'HttpConnectionsPerHost', fallback=10
+            ),
+            self.config.getfloat('Performance', 'HttpTimeout', fallback=10.0)
+        )
+        self.register_metrics(
+            "Database Pool", lambda: self.database_pool.stats()._asdict()
+        )
+        self.register_metrics(
+            "Guild Config Cache", self.guild_config_cache.stats
+        )
+        self.register_metrics("EXP Ledger", self.exp_ledger.stats)
+        self.register_metrics("HTTP Client", self.http_client.stats)
+        self.discord_bot.add_listener(
+            self._on_application_command_error,
+            "on_application_command_error"
+        )
+        self.add_migrations("core", "migrations")
         # Load plugins specified in config file
         for cmd_plugin in self.config['Plugins']['Commands'].split(","):
             self.load_plugin(cmd_plugin.strip(), plugin_types.COMMAND)
@@ -61,6 +101,7 @@ class PhotonBot:
             self.load_plugin(event_plugin.strip(), plugin_types.EVENT)
         for task_plugin in self.config['Plugins']['Tasks'].split(","):
             self.load_plugin(task_plugin.strip(), plugin_types.TASK)
+        self.run_migrations()
 
     def load_plugin(self, name: str, plugin_type: int):
         """
@@ -88,10 +129,142 @@ class PhotonBot:
         finally:
             os.chdir(old_cwd)
 
-    def start(self, *args, **kwargs):
+    def add_migrations(self, namespace: str, directory: str):
         """
-        Login and open a connection to Discord
+        Register a directory of SQL migrations to be applied when the bot
+        starts. Plugins should call this from their register function with a
+        namespace unique to the plugin. Relative directories are resolved from
+        the bot's directory. See `utils.run_migrations` for the format of
+        migration files.
+        """
+        self.migrations.append((
+            namespace, os.path.join(self.directory_location, directory)
+        ))
+
+    def run_migrations(self):
         """
-        self.discord_bot.run(
-            *args, **kwargs, token=self.config['DiscordAuth']['Token']
+        Apply any migrations that have not yet been applied to the database,
+        in the order their directories were registered. Called automatically
+        after plugins are loaded.
+        """
+        for namespace, directory in self.migrations:
+            for file_name in utils.run_migrations(
+                    self.config['DatabaseConnection'], namespace, directory):
+                print(f"Applied {namespace} migration {file_name}")
+
+    def add_api_provider(self, name: str):
+        """
+        Register a third-party API with the shared HTTP client so that
+        requests made with `provider=name` are rate limited, and stop being
+        sent while the API is failing. The rate limit can be set for each
+        provider in the `ApiRateLimits` section of the config file, and
+        defaults to `ApiRateLimit` in the `Performance` section.
+        """
+        self.http_client.add_provider(http_client.ApiProvider(
+            name,
+            self.config.getfloat(
+                'ApiRateLimits', name, fallback=self.config.getfloat(
+                    'Performance', 'ApiRateLimit', fallback=60.0
+                )
+            ),
+            self.config.getint('Performance', 'ApiRateBurst', fallback=10),
+            self.config.getint(
+                'Performance', 'ApiFailureThreshold', fallback=5
+            ),
+            self.config.getfloat(
+                'Performance', 'ApiRecoveryTime', fallback=30.0
+            )
+        ))
+        self.register_metrics(
+            f"{name} API", self.http_client.providers[name].stats
         )
+
+    async def _on_application_command_error(self, ctx, error: Exception):
+        original = getattr(error, "original", error)
+        if isinstance(original, http_client.ProviderUnavailable):
+            try:
+                await ctx.respond(
+                    f"**{original.provider}** can't be reached right now, "
+                    + "please try again later", ephemeral=True
+                )
+            except discord.HTTPException:
+                pass
+            return
+        # Adding a listener stops pycord printing errors itself
+        print(f"Ignoring exception in command {ctx.command}:", file=sys.stderr)
+        traceback.print_exception(
+            type(error), error, error.__traceback__, file=sys.stderr
+        )
+
+    def register_metrics(self, name: str, callback):
+        """
+        Register a function that reports statistics about part of the bot.
+        `callback` should take no arguments and return a dictionary mapping
+        statistic names to their current values.
+        """
+        self.metrics[name] = callback
+
+    def get_metrics(self):
+        """
+        Get the current value of every statistic registered with
+        `register_metrics`, grouped by the name they were registered under.
+        """
+        return {name: callback() for name, callback in self.metrics.items()}
+
+    def add_shutdown_hook(self, callback):
+        """
+        Register a coroutine function to be awaited when the bot shuts down,
+        after the connection to Discord has been closed. Hooks are run in the
+        reverse order to which they were added.
+        """
+        self.shutdown_hooks.append(callback)
+
+    async def shutdown(self):
+        """
+        Close the connection to Discord if it is still open, run every
+        shutdown hook, then close the HTTP client and the database connection
+        pool.
+        """
+        if not self.discord_bot.is_closed():
+            await self.discord_bot.close()
+        for callback in reversed(self.shutdown_hooks):
+            try:
+                await callback()
+            except Exception as error:
+                print(
+                    f"Error in shutdown hook {callback.__qualname__}: {error}"
+                )
+        await self.http_client.close()
+        self.database_pool.close()
+
+    def start(self, *args, **kwargs):
+        """
+        Login and open a connection to Discord. Blocks until the bot is
+        stopped, at which point the shutdown hooks are run.
+        """
+        loop = self.discord_bot.loop
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(
+                    signal_number,
+                    lambda: asyncio.ensure_future(self.discord_bot.close())
+                )
+            except (NotImplementedError, RuntimeError):
+                pass
+        try:
+            loop.run_until_complete(self.discord_bot.start(
+                *args, **kwargs, token=self.config['DiscordAuth']['Token']
+            ))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(self.shutdown())
+            # Cancel anything left running, such as task loops
+            remaining = asyncio.all_tasks(loop)
+            for task in remaining:
+                task.cancel()
+            loop.run_until_complete(
+                asyncio.gather(*remaining, return_exceptions=True)
+            )
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
@@ -2,7 +2,6 @@
 import discord
 from discord.commands import Option
 from discord.commands.context import ApplicationContext
-from mariadb import IntegrityError
 
 import utils
 from photon_bot import PhotonBot
@@ -22,11 +21,13 @@ def register_commands(bot: PhotonBot):
                 ephemeral=True
             )
             return
-        with utils.Database(bot.config['DatabaseConnection']) as database:
-            database.modify(
+        async with utils.AsyncDatabase(
+                bot.config['DatabaseConnection']) as database:
+            await database.modify(
                 "UPDATE guild_config SET exp_levelup_channel=NULL "
                 + "WHERE guild_id = %s;", (ctx.guild.id,)
             )
+        bot.guild_config_cache.update(ctx.guild.id, exp_levelup_channel=None)
         await ctx.respond(
             "Level up alerts have been reset", ephemeral=True
         )
@@ -42,21 +43,18 @@ def register_commands(bot: PhotonBot):
                 ephemeral=True
             )
             return
-        with utils.Database(bot.config['DatabaseConnection']) as database:
-            if not database.modify(
-                    "UPDATE guild_config SET exp_levelup_channel = %s "
-                    + "WHERE guild_id = %s;", (ctx.channel.id, ctx.guild.id)):
-                try:
-                    database.modify(
-                        "INSERT INTO guild_config "
-                        + "(guild_id, exp_levelup_channel) VALUES (%s, %s);",
-                        (ctx.guild.id, ctx.channel.id)
-                    )
-                except IntegrityError:
-                    await ctx.respond(
-                        "Level up alerts are already sent here", ephemeral=True
-                    )
-                    return
+        async with utils.AsyncDatabase(
+                bot.config['DatabaseConnection']) as database:
+            if not await database.upsert(
+                    "guild_config", {"guild_id": ctx.guild.id},
+                    {"exp_levelup_channel": ctx.channel.id}):
+                await ctx.respond(
+                    "Level up alerts are already sent here", ephemeral=True
+                )
+                return
+        bot.guild_config_cache.update(
+            ctx.guild.id, exp_levelup_channel=ctx.channel.id
+        )
         await ctx.respond(
             "Level up alerts will now be sent here", ephemeral=True
         )
@@ -70,21 +68,16 @@ def register_commands(bot: PhotonBot):
                 ephemeral=True
             )
             return
-        with utils.Database(bot.config['DatabaseConnection']) as database:
-            if not database.modify(
-                    "UPDATE guild_config SET exp_levelup_channel=0 "
-                    + "WHERE guild_id = %s;", (ctx.guild.id,)):
-                try:
-                    database.modify(
-                        "INSERT INTO guild_config "
-                        + "(guild_id, exp_levelup_channel) VALUES (%s, 0);",
-                        (ctx.guild.id,)
-                    )
-                except IntegrityError:
-                    await ctx.respond(
-                        "Level up alerts are already disabled", ephemeral=True
-                    )
-                    return
+        async with utils.AsyncDatabase(
+                bot.config['DatabaseConnection']) as database:
+            if not await database.upsert(
+                    "guild_config", {"guild_id": ctx.guild.id},
+                    {"exp_levelup_channel": 0}):
+                await ctx.respond(
+                    "Level up alerts are already disabled", ephemeral=True
+                )
+                return
+        bot.guild_config_cache.update(ctx.guild.id, exp_levelup_channel=0)
         await ctx.respond(
             "Level up alerts are now disabled", ephemeral=True
         )
@@ -100,22 +93,19 @@ def register_commands(bot: PhotonBot):
                 ephemeral=True
             )
             return
-        guild_config = utils.get_guild_config(
-            bot.config['DatabaseConnection'], ctx.guild.id
-        )
+        guild_config = await bot.guild_config_cache.get(ctx.guild.id)
         current_exp_state = (
             guild_config.exp_active or guild_config.exp_active is None
         )
-        with utils.Database(bot.config['DatabaseConnection']) as database:
-            if not database.modify(
-                    "UPDATE guild_config SET exp_active = %s "
-                    + "WHERE guild_id = %s;",
-                    (int(not current_exp_state), ctx.guild.id)):
-                database.modify(
-                    "INSERT INTO guild_config "
-                    + "(guild_id, exp_active) VALUES (%s, %s);",
-                    (ctx.guild.id, int(not current_exp_state))
-                )
+        async with utils.AsyncDatabase(
+                bot.config['DatabaseConnection']) as database:
+            await database.upsert(
+                "guild_config", {"guild_id": ctx.guild.id},
+                {"exp_active": int(not current_exp_state)}
+            )
+        bot.guild_config_cache.update(
+            ctx.guild.id, exp_active=int(not current_exp_state)
+        )
         await ctx.respond(
             f"EXP has been {'disabled' if current_exp_state else 'enabled'}",
             ephemeral=True
@@ -142,16 +132,7 @@ def register_commands(bot: PhotonBot):
             user_id = user
         else:
             user_id = user.id
-        with utils.Database(bot.config['DatabaseConnection']) as database:
-            if not database.modify(
-                    "UPDATE user_exp SET exp = %s "
-                    + "WHERE guild_id = %s AND user_id = %s;",
-                    (exp, ctx.guild.id, user_id)):
-                database.modify(
-                    "INSERT INTO user_exp (guild_id, user_id, exp) "
-                    + "VALUES (%s, %s, %s);",
-                    (ctx.guild.id, user_id, exp)
-                )
+        await bot.exp_ledger.set_exp(ctx.guild.id, user_id, exp)
         await ctx.respond("EXP successfully updated", ephemeral=True)
 
     @bot.discord_bot.command()
@@ -205,6 +205,22 @@ def register_commands(bot: PhotonBot):
         )
         await ctx.respond(embed=embed)
 
+    @bot.discord_bot.command()
+    async def botstats(ctx: ApplicationContext):
+        """Get performance statistics about this bot"""
+        embed = discord.Embed(title="Bot Statistics", color=ctx.author.color)
+        for name, statistics in bot.get_metrics().items():
+            value = ""
+            for statistic, statistic_value in statistics.items():
+                if isinstance(statistic_value, float):
+                    statistic_value = f"{statistic_value:.3f}"
+                value += (
+                    f"**{statistic.replace('_', ' ').capitalize()}:** "
+                    + f"`{statistic_value}`\n"
+                )
+            embed.add_field(name=name, value=value or "None", inline=True)
+        await ctx.respond(embed=embed)
+
     @bot.discord_bot.command()
     async def serverinfo(ctx: ApplicationContext):
         """Get information about this server"""
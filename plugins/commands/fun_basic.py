@@ -5,21 +5,31 @@ import string
 import asyncio
 import discord
 import nekos
-import requests
 from discord.commands import Option
 from discord.commands.context import ApplicationContext
 
 from photon_bot import PhotonBot
+import utils
 
 
 def register_commands(bot: PhotonBot):
+    bot.add_api_provider("NumbersAPI")
+    # Users asking for the same fact at once share a single request
+    num_fact_flight = utils.SingleFlight()
+    bot.register_metrics("Number Fact Requests", num_fact_flight.stats)
+
+    async def get_num_fact(url: str):
+        return await num_fact_flight.run(
+            url, lambda: bot.http_client.get_text(url, provider="NumbersAPI")
+        )
+
     num_fact_group = bot.discord_bot.create_group("numfact")
 
     @num_fact_group.command()
     async def trivia(ctx: ApplicationContext,
             number: Option(int, "Number to get trivia for")):
         """Get a general trivia fact about a particular number"""
-        fact = requests.get(f"http://numbersapi.com/{number}").text
+        fact = await get_num_fact(f"http://numbersapi.com/{number}")
         await ctx.respond(
             f"**A random fact about {number} is:** `{fact}`"
         )
@@ -28,7 +38,7 @@ def register_commands(bot: PhotonBot):
     async def math(ctx: ApplicationContext,
             number: Option(int, "Number to get a math fact for")):
         """Get a mathematical fact about a particular number"""
-        fact = requests.get(f"http://numbersapi.com/{number}/math").text
+        fact = await get_num_fact(f"http://numbersapi.com/{number}/math")
         await ctx.respond(
             f"**A mathematical fact about {number} is:** `{fact}`"
         )
@@ -38,7 +48,9 @@ def register_commands(bot: PhotonBot):
             date: Option(int, "Date to get a fact for"),
             month: Option(int, "Month to get a fact for")):
         """Get a fact about a particular date"""
-        fact = requests.get(f"http://numbersapi.com/{month}/{date}/date").text
+        fact = await get_num_fact(
+            f"http://numbersapi.com/{month}/{date}/date"
+        )
         await ctx.respond(
             f"**A mathematical fact about {date}/{month} is:** `{fact}`"
         )
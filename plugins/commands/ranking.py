@@ -1,18 +1,191 @@
 """Commands used to check information about member EXP."""
+import asyncio
 import random
 from io import BytesIO
 
 import discord
-import requests
 from discord.commands import Option
 from discord.commands.context import ApplicationContext
-from PIL import Image, ImageDraw, ImageFont
+from discord.enums import ButtonStyle
+from discord.ext import pages
 
+import avatars
+import rendering
 from photon_bot import PhotonBot
 import utils
 
+# Rows shown on each page of /leaderboard
+TEXT_PAGE_SIZE = 15
+IMAGE_PAGE_SIZE = 5
+
+
+class LeaderboardPaginator(pages.Paginator):
+    """
+    Shows the EXP leaderboard of a guild one page at a time. Pages are only
+    loaded and drawn when they are shown. Moving to the next or previous page
+    continues from the rows on the page currently shown with keyset
+    pagination, so rows are never skipped or repeated if EXP changes while
+    paging, and every page is equally fast to load at any depth.
+    """
+    def __init__(self, ledger: utils.ExpLedger, guild_id: int,
+            page_size: int, page_count: int, build_page):
+        """
+        Create a paginator with `page_count` pages of `page_size` rows.
+        `build_page` should be a coroutine function taking the 0-based
+        position of the first row on a page and the list of (user_id, exp)
+        rows on it, returning a `pages.Page`.
+        """
+        self._ledger = ledger
+        self._guild_id = guild_id
+        self._page_size = page_size
+        self._build_page = build_page
+        # The number and rows of the page currently shown
+        self._shown = None
+        jump_button = discord.ui.Button(
+            label="My Position", style=ButtonStyle.primary, row=1
+        )
+        jump_button.callback = self.goto_own_page
+        super().__init__(
+            [""] * page_count, custom_view=discord.ui.View(jump_button)
+        )
+
+    async def load_page(self, page_number: int):
+        """
+        Load and draw a page so that it can be shown, returning the number of
+        the page that was loaded. If the page is past the end of the
+        leaderboard, such as after users were removed from it, the last page
+        is loaded instead.
+        """
+        if self._shown is not None and len(self._shown[1]) > 0:
+            shown_number, shown_rows = self._shown
+            first_key = (shown_rows[0][1], shown_rows[0][0])
+            last_key = (shown_rows[-1][1], shown_rows[-1][0])
+        else:
+            shown_number = None
+        if shown_number is not None and page_number == shown_number + 1:
+            start, rows = await self._ledger.page(
+                self._guild_id, self._page_size, after=last_key
+            )
+        elif (shown_number is not None and page_number > 0
+                and page_number == shown_number - 1):
+            start, rows = await self._ledger.page(
+                self._guild_id, self._page_size, before=first_key
+            )
+        else:
+            start, rows = await self._ledger.page(
+                self._guild_id, self._page_size,
+                position=page_number * self._page_size
+            )
+        if len(rows) == 0 and page_number > 0:
+            size = await self._ledger.size(self._guild_id)
+            page_number = max(-(-size // self._page_size) - 1, 0)
+            start, rows = await self._ledger.page(
+                self._guild_id, self._page_size,
+                position=page_number * self._page_size
+            )
+        if len(rows) == 0:
+            self.pages[page_number] = pages.Page(
+                content="Nobody has any EXP in this server!"
+            )
+        else:
+            self.pages[page_number] = await self._build_page(start, rows)
+        self._shown = (page_number, rows)
+        return page_number
+
+    async def goto_page(self, page_number: int = 0, *,
+            interaction: discord.Interaction = None):
+        # Loading a page can take longer than Discord allows for responding
+        # to an interaction, so the button press is acknowledged first and
+        # the message is then edited directly
+        if interaction is not None and not interaction.response.is_done():
+            await interaction.response.defer()
+        page_number = await self.load_page(page_number)
+        await super().goto_page(page_number)
+
+    async def goto_own_page(self, interaction: discord.Interaction):
+        """Show the page that the user who pressed a button is on."""
+        await interaction.response.defer()
+        position = await self._ledger.position(
+            self._guild_id, interaction.user.id
+        )
+        self.current_page = min(position // self._page_size, self.page_count)
+        await self.goto_page(self.current_page)
+
+
+class ImagePage(pages.Page):
+    """
+    A paginator page showing a single image. A new file is made from the
+    image data every time the page is sent, so the page can be shown any
+    number of times without relying on an earlier file still being open.
+    """
+    def __init__(self, data: bytes, filename: str):
+        """Create a page showing `data` as an attachment named `filename`."""
+        self._data = data
+        self._filename = filename
+        # Pages must have content or embeds, so the content is left empty
+        super().__init__(content="", files=[self._make_file()])
+
+    def _make_file(self):
+        return discord.File(BytesIO(self._data), filename=self._filename)
+
+    def update_files(self):
+        self._files = [self._make_file()]
+        return self._files
+
 
 def register_commands(bot: PhotonBot):
+    renderer = rendering.Renderer(
+        bot.config.getint('Performance', 'RenderWorkers', fallback=2),
+        rendering.ImageEncoding(
+            bot.config.get(
+                'Performance', 'ImageFormat', fallback="png"
+            ).strip().lower(),
+            bot.config.getint(
+                'Performance', 'ImageCompressLevel', fallback=6
+            ),
+            bot.config.getint('Performance', 'ImageQuality', fallback=90)
+        )
+    )
+    # Load the assets in every worker now rather than on the first render
+    renderer.start()
+    bot.variables["renderer"] = renderer
+    bot.register_metrics("Renderer", renderer.stats)
+
+    async def close_renderer():
+        renderer.close()
+
+    bot.add_shutdown_hook(close_renderer)
+
+    avatar_fetcher = avatars.AvatarFetcher(
+        bot.http_client,
+        bot.config.getint('Performance', 'AvatarCacheSize', fallback=512),
+        bot.config.get('Performance', 'AvatarCacheDirectory', fallback="")
+    )
+    bot.variables["avatar_fetcher"] = avatar_fetcher
+    bot.register_metrics("Avatar Cache", avatar_fetcher.stats)
+
+    render_cache = rendering.RenderCache(
+        bot.config.getint('Performance', 'RenderCacheSize', fallback=256)
+    )
+    bot.variables["render_cache"] = render_cache
+    bot.register_metrics("Render Cache", render_cache.stats)
+
+    # Limits how many users and avatars are requested from Discord at once
+    lookup_semaphore = asyncio.Semaphore(
+        bot.config.getint('Performance', 'LeaderboardConcurrency', fallback=5)
+    )
+
+    async def get_user(user_id: int):
+        user = bot.discord_bot.get_user(user_id)
+        if user is None:
+            async with lookup_semaphore:
+                user = await bot.discord_bot.fetch_user(user_id)
+        return user
+
+    async def get_avatar(user: discord.User, size: int):
+        async with lookup_semaphore:
+            return await avatar_fetcher.get(user, size)
+
     rank_calculator_group = bot.discord_bot.create_group("rankcalculator")
 
     @rank_calculator_group.command()
@@ -52,69 +225,19 @@ def register_commands(bot: PhotonBot):
         if isinstance(member, int):
             member = await bot.discord_bot.fetch_user(member)
         user = member or ctx.author
-        exp_info = utils.get_exp_info(
-            bot.config['DatabaseConnection'], ctx.guild.id, user.id
-        )
-        user_avatar = Image.open(BytesIO(
-            requests.get(user.display_avatar.url).content))
-        customised = True
-        if None in exp_info.color:
-            customised = False
-            color = user_avatar.convert(mode="RGB").resize(
-                (1, 1)).getpixel((0, 0))
-        else:
-            color = exp_info.color
-        rank_card = Image.new("RGBA", (512, 630), color)
-        rank_card.paste(
-            Image.open("resources/images/RankCardTemplate.png"),
-            mask=Image.open(
-                "resources/images/RankCardMask.png").convert(mode="1")
-        )
-        resized_avatar = user_avatar.resize((192, 192), Image.LANCZOS)
-        avatar_mask = Image.open(
-                "resources/images/AvatarMask.png")
-        avatar_mask.paste(resized_avatar, mask=avatar_mask)
-        rank_card.paste(
-            resized_avatar,
-            box=(24, 45, 216, 237),
-            mask=avatar_mask
-        )
-        card_draw = ImageDraw.Draw(rank_card)
-        rank_font = "resources/fonts/DejaVuSans.ttf"
-        card_draw.text(
-            (250, 143), str(exp_info.level), fill=color,
-            font=ImageFont.truetype(rank_font, 72)
-        )
-        card_draw.text(
-            (24, 270), user.name, fill=color,
-            font=ImageFont.truetype(rank_font, 60)
-        )
-        card_draw.text(
-            (24, 353), str(exp_info.exp), fill=color,
-            font=ImageFont.truetype(rank_font, 48)
-        )
-        card_draw.text(
-            (24, 429), str(exp_info.rank), fill=color,
-            font=ImageFont.truetype(rank_font, 48)
-        )
-        card_draw.text(
-            (24, 566), str(exp_info.remaining), fill=color,
-            font=ImageFont.truetype(rank_font, 30)
-        )
-        card_draw.text(
-            (372, 566), str(exp_info.next_level), fill=color,
-            font=ImageFont.truetype(rank_font, 30)
-        )
-        card_draw.rectangle(
-            (
-                (23, 509),
-                (23 + round(463 * (exp_info.remaining / exp_info.next_level)),
-                 549)
-            ),
-            fill=color
-        )
-
-        rank_card.save(f"/tmp/rank-card-{user.id}.png", "PNG")
+        exp_info = await bot.exp_ledger.get_exp_info(ctx.guild.id, user.id)
+        customised = None not in exp_info.color
+        cache_key = ("rank", user.name, user.display_avatar.key, exp_info)
+        rank_card = render_cache.get(cache_key)
+        if rank_card is None:
+            avatar_data = await avatar_fetcher.get(
+                user, rendering.RANK_CARD_AVATAR_SIZE
+            )
+            rank_card = await renderer.rank_card(
+                avatar_data, exp_info.color if customised else None,
+                user.name, exp_info._asdict()
+            )
+            render_cache.set(cache_key, rank_card)
         content = None
         if not customised and user == ctx.author:
             content = random.choice([
@@ -125,7 +248,9 @@ def register_commands(bot: PhotonBot):
             ])
         await ctx.respond(
             content,
-            file=discord.File(f"/tmp/rank-card-{user.id}.png")
+            file=discord.File(
+                BytesIO(rank_card), filename=f"rank-card.{renderer.extension}"
+            )
         )
 
     @bot.discord_bot.command()
@@ -136,9 +261,7 @@ def register_commands(bot: PhotonBot):
         if isinstance(member, int):
             member = await bot.discord_bot.fetch_user(member)
         user = member or ctx.author
-        exp_info = utils.get_exp_info(
-            bot.config['DatabaseConnection'], ctx.guild.id, user.id
-        )
+        exp_info = await bot.exp_ledger.get_exp_info(ctx.guild.id, user.id)
         progress_bar = "█" * round(
             20 * (exp_info.remaining / exp_info.next_level)
         )
@@ -149,76 +272,88 @@ def register_commands(bot: PhotonBot):
             + f"**{exp_info.remaining} / {exp_info.next_level}**"
         )
 
+    async def draw_board(start: int, rows: list, extra_rows: list):
+        """
+        Draw rows of the leaderboard with their names, EXP and level, followed
+        by a strip of avatars for `extra_rows`.
+        """
+        users = await asyncio.gather(
+            *(get_user(x[0]) for x in rows + extra_rows)
+        )
+        # The template only numbers the top 5, so deeper rows are numbered
+        names = [
+            str(user) if start == 0 else f"#{start + index + 1} {user}"
+            for index, user in enumerate(users[:len(rows)])
+        ]
+        cache_key = ("leaderboard", tuple(names), tuple(
+            (user.display_avatar.key, exp)
+            for user, (_, exp) in zip(users, rows + extra_rows)
+        ))
+        board = render_cache.get(cache_key)
+        if board is None:
+            avatar_list = await asyncio.gather(*(
+                get_avatar(x, rendering.LEADERBOARD_AVATAR_SIZE)
+                for x in users
+            ))
+            levels = utils.calculate_levels([x[1] for x in rows])[0]
+            top_lineup = [
+                (avatar_data, name, exp, int(level))
+                for avatar_data, name, (_, exp), level in zip(
+                    avatar_list, names, rows, levels
+                )
+            ]
+            board = await renderer.leaderboard(
+                top_lineup, avatar_list[len(rows):], start
+            )
+            render_cache.set(cache_key, board)
+        return board
+
     @bot.discord_bot.command()
-    async def leaderboard(ctx: ApplicationContext):
+    async def leaderboard(ctx: ApplicationContext,
+            mode: Option(
+                str, "Whether to show the leaderboard as an image or text",
+                choices=["image", "text"], required=False
+            )):
         """View the members with the most EXP across the whole server"""
-        # Command takes a long time (>3 seconds) so must be deferred
+        # Uncached avatars can take a while to download, so must be deferred
         await ctx.defer()
-        with utils.Database(bot.config['DatabaseConnection']) as database:
-            guild_response = database.fetch(
-                "SELECT user_id, exp FROM user_exp WHERE guild_id = %s "
-                + "ORDER BY exp DESC LIMIT 15;",
-                (ctx.guild.id,)
-            )
-        board = Image.open("resources/images/LeaderboardTemplate.png")
-        top_lineup = guild_response[:5]
-        bottom_lineup = guild_response[5:]
-        if len(top_lineup) == 0:
+        guild_size = await bot.exp_ledger.size(ctx.guild.id)
+        if guild_size == 0:
             await ctx.respond("Nobody has any EXP in this server!")
             return
-        if len(bottom_lineup) == 0:
-            board = board.crop((0, 0, 1260, 540))
-        if len(top_lineup) < 5:
-            board = board.crop(
-                (0, 0, 1260, 540 - (108 * (5 - len(top_lineup))))
-            )
-        avatar_mask_base = Image.open(
-                "resources/images/AvatarMask.png").resize(
-                    (95, 95), Image.LANCZOS)
-        board_draw = ImageDraw.Draw(board)
-        board_font = "resources/fonts/DejaVuSans.ttf"
-        for index, (user_id, exp) in enumerate(top_lineup):
-            user = await bot.discord_bot.fetch_user(user_id)
-            level = utils.calculate_level(exp)[0]
-            user_avatar = Image.open(BytesIO(
-                requests.get(user.display_avatar.url).content)).resize(
-                    (95, 95), Image.LANCZOS)
-            avatar_mask = avatar_mask_base.copy()
-            avatar_mask.paste(user_avatar, mask=avatar_mask)
-            board.paste(
-                user_avatar,
-                box=(17, 7 + (index * 108), 112, 102 + (index * 108)),
-                mask=avatar_mask
-            )
-            board_draw.text(
-                (140, 33 + (index * 108)), str(user), fill=(0, 0, 0),
-                font=ImageFont.truetype(board_font, 35)
-            )
-            board_draw.text(
-                (900, 2 + (index * 108)), str(exp), fill=(0, 0, 0),
-                font=ImageFont.truetype(board_font, 40)
-            )
-            board_draw.text(
-                (900, 55 + (index * 108)), str(level), fill=(0, 0, 0),
-                font=ImageFont.truetype(board_font, 40)
-            )
-        for index, (user_id, _) in enumerate(bottom_lineup):
-            user = await bot.discord_bot.fetch_user(user_id)
-            user_avatar = Image.open(BytesIO(
-                requests.get(user.display_avatar.url).content)).resize(
-                    (95, 95), Image.LANCZOS)
-            avatar_mask = avatar_mask_base.copy()
-            avatar_mask.paste(user_avatar, mask=avatar_mask)
-            board.paste(
-                user_avatar,
-                box=(90 + (index * 108), 546, 185 + (index * 108), 641),
-                mask=avatar_mask
-            )
 
-        board.save(f"/tmp/leaderboard-{ctx.guild.id}.png", "PNG")
-        await ctx.respond(
-            file=discord.File(f"/tmp/leaderboard-{ctx.guild.id}.png")
+        async def build_text_page(start: int, rows: list):
+            users = await asyncio.gather(*(get_user(x[0]) for x in rows))
+            levels = utils.calculate_levels([x[1] for x in rows])[0]
+            board = "**EXP Leaderboard**"
+            for index, (user, (_, exp), level) in enumerate(
+                    zip(users, rows, levels)):
+                board += (
+                    f"\n`#{start + index + 1}` **{user}**: `{exp}` **EXP** "
+                    + f"| `{level}` **LV**"
+                )
+            return pages.Page(content=board)
+
+        async def build_image_page(start: int, rows: list):
+            extra_rows = []
+            if start == 0 and len(rows) > 0:
+                # The first page also shows the avatars of the next 10 users
+                _, extra_rows = await bot.exp_ledger.page(
+                    ctx.guild.id, 10, after=(rows[-1][1], rows[-1][0])
+                )
+            board = await draw_board(start, rows, extra_rows)
+            return ImagePage(board, f"leaderboard.{renderer.extension}")
+
+        if mode == "text":
+            page_size, build_page = TEXT_PAGE_SIZE, build_text_page
+        else:
+            page_size, build_page = IMAGE_PAGE_SIZE, build_image_page
+        paginator = LeaderboardPaginator(
+            bot.exp_ledger, ctx.guild.id, page_size,
+            -(-guild_size // page_size), build_page
         )
+        await paginator.load_page(0)
+        await paginator.respond(ctx.interaction)
 
     @bot.discord_bot.command()
     async def changerank(ctx: ApplicationContext,
@@ -234,16 +369,12 @@ def register_commands(bot: PhotonBot):
                 ephemeral=True
             )
             return
-        with utils.Database(bot.config['DatabaseConnection']) as database:
-            if not database.modify(
-                    "UPDATE user_exp_card SET red = %s, green = %s, "
-                    + "blue = %s WHERE user_id = %s;",
-                    (red, green, blue, ctx.author.id)):
-                database.modify(
-                    "INSERT INTO user_exp_card (user_id, red, green, blue) "
-                    + "VALUES (%s, %s, %s, %s);",
-                    (ctx.author.id, red, green, blue)
-                )
+        async with utils.AsyncDatabase(
+                bot.config['DatabaseConnection']) as database:
+            await database.upsert(
+                "user_exp_card", {"user_id": ctx.author.id},
+                {"red": red, "green": green, "blue": blue}
+            )
         await ctx.respond("Rank card updated", ephemeral=True)
 
     @bot.discord_bot.command()
@@ -251,8 +382,9 @@ def register_commands(bot: PhotonBot):
         """
         Reset the color of your rank card to be based on your profile picture.
         """
-        with utils.Database(bot.config['DatabaseConnection']) as database:
-            database.modify(
+        async with utils.AsyncDatabase(
+                bot.config['DatabaseConnection']) as database:
+            await database.modify(
                 "DELETE FROM user_exp_card WHERE user_id = %s;",
                 (ctx.author.id,)
             )
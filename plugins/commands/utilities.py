@@ -2,6 +2,7 @@
 import datetime
 import random
 import time
+from io import BytesIO
 
 import discord
 import qrcode
@@ -34,24 +35,25 @@ def register_commands(bot: PhotonBot):
         due_datetime = datetime.datetime.now() + datetime.timedelta(
             days=days, hours=hours, minutes=minutes, seconds=seconds
         )
-        with utils.Database(bot.config['DatabaseConnection']) as database:
-            database.modify(
+        async with utils.AsyncDatabase(
+                bot.config['DatabaseConnection']) as database:
+            reminder_id = await database.insert(
                 "INSERT INTO reminders (due_datetime, user_id, content) "
                 + "VALUES (%s, %s, %s);",
                 (due_datetime, ctx.author.id, content)
             )
-        await ctx.respond(
-            "Reminder added successfully. Note that reminders are only "
-            + "pushed once per minute, so reminders could be delayed by up "
-            + "to a minute",
-            ephemeral=True
-        )
+        if "reminder_scheduler" in bot.variables:
+            bot.variables["reminder_scheduler"].add(
+                reminder_id, due_datetime, ctx.author.id, content
+            )
+        await ctx.respond("Reminder added successfully", ephemeral=True)
 
     @reminder_group.command()
     async def current(ctx: ApplicationContext):
         """List all of your currently set reminders"""
-        with utils.Database(bot.config['DatabaseConnection']) as database:
-            reminder_list = database.fetch(
+        async with utils.AsyncDatabase(
+                bot.config['DatabaseConnection']) as database:
+            reminder_list = await database.fetch(
                 "SELECT due_datetime, content FROM reminders "
                 + "WHERE user_id = %s ORDER BY due_datetime ASC;",
                 (ctx.author.id,)
@@ -63,8 +65,6 @@ def register_commands(bot: PhotonBot):
             return
         embed = discord.Embed(
             title="Currently Set Reminders",
-            description="Note that reminders are only pushed once per "
-            + "minute, so times could be up to a minute out",
             color=ctx.author.color
         )
         for index, reminder in enumerate(reminder_list):
@@ -89,9 +89,10 @@ def register_commands(bot: PhotonBot):
                 "Reminder numbers must be 1 or greater", ephemeral=True
             )
             return
-        with utils.Database(bot.config['DatabaseConnection']) as database:
-            reminder_list = database.fetch(
-                "SELECT due_datetime, content FROM reminders "
+        async with utils.AsyncDatabase(
+                bot.config['DatabaseConnection']) as database:
+            reminder_list = await database.fetch(
+                "SELECT id FROM reminders "
                 + "WHERE user_id = %s ORDER BY due_datetime ASC;",
                 (ctx.author.id,)
             )
@@ -105,19 +106,18 @@ def register_commands(bot: PhotonBot):
                     "You do not have that many reminders", ephemeral=True
                 )
                 return
-            reminder = reminder_list[number - 1]
-            if database.modify(
-                    "DELETE FROM reminders WHERE due_datetime = %s "
-                    + "AND user_id = %s AND content = %s LIMIT 1;",
-                    (reminder[0], ctx.author.id, reminder[1])):
-                await ctx.respond(
-                    "Reminder deleted successfully", ephemeral=True
-                )
-            else:
-                await ctx.respond(
-                    "Something went wrong deleting the reminder",
-                    ephemeral=True
-                )
+            reminder_id = reminder_list[number - 1][0]
+            deleted = await database.modify(
+                "DELETE FROM reminders WHERE id = %s;", (reminder_id,)
+            )
+        if "reminder_scheduler" in bot.variables:
+            bot.variables["reminder_scheduler"].remove(reminder_id)
+        if deleted:
+            await ctx.respond("Reminder deleted successfully", ephemeral=True)
+        else:
+            await ctx.respond(
+                "Something went wrong deleting the reminder", ephemeral=True
+            )
 
     random_group = bot.discord_bot.create_group("random")
 
@@ -162,10 +162,15 @@ def register_commands(bot: PhotonBot):
     async def qr(ctx: ApplicationContext,
             text: Option(str, "The text to encode")):
         """Generate a QR Code from a piece of text"""
-        qrcode.make(text).save(f"/tmp/qrcode-{ctx.author.id}.png", "PNG")
-        await ctx.respond(
-            file=discord.File(f"/tmp/qrcode-{ctx.author.id}.png")
+        # QR codes only have two colors, so lossless PNG is always smallest
+        output = BytesIO()
+        qrcode.make(text).save(
+            output, "PNG", compress_level=bot.config.getint(
+                'Performance', 'ImageCompressLevel', fallback=6
+            )
         )
+        output.seek(0)
+        await ctx.respond(file=discord.File(output, filename="qrcode.png"))
 
     @bot.discord_bot.command()
     async def timestamp(ctx: ApplicationContext,
@@ -3,19 +3,24 @@ Commands that pull data from online third-party APIs.
 Requires all third-party authentication information to be present in the config
 file.
 """
+import asyncio
 import datetime
+import functools
+import re
 
 import asyncpraw
+import asyncprawcore
 import discord
 import discord.ext.pages
-import requests
 import srcomapi
 import wikipedia
 import wolframalpha
 from discord.commands import Option
 from discord.commands.context import ApplicationContext
 
+from http_client import ProviderUnavailable
 from photon_bot import PhotonBot
+import utils
 
 URLS = {
     "OpenWeatherMap":
@@ -43,8 +48,89 @@ URLS = {
     "https://www.googleapis.com/customsearch/v1?cx={0}&safe={1}&searchType=image&key={2}&q={3}"
 }
 
+# Seconds that responses from each API are cached for. Stale responses can
+# be sent for the same amount of time again while they are refreshed.
+CACHE_TTLS = {
+    "OpenWeatherMap": 600,
+    "OxfordDictionary": 7 * 24 * 3600,
+    "OxfordLemmas": 7 * 24 * 3600,
+    "OMDb": 24 * 3600,
+    "UrbanDictionary": 3600,
+    "GoogleCustomSearch": 24 * 3600,
+    "WolframAlpha": 24 * 3600,
+    "Reddit": 300
+}
+
+# APIs that ignore the case of what is looked up, so lookups that only differ
+# in case can share a cached response
+CASE_INSENSITIVE_APIS = {
+    "OpenWeatherMap", "OMDb", "UrbanDictionary", "GoogleCustomSearch", "Reddit"
+}
+
+# Subreddit names are letters, numbers and underscores, at most 21 long
+SUBREDDIT_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_]{1,20}")
+
+# The provider each API is rate limited under, which is shared by APIs that
+# count towards the same quota
+PROVIDERS = {
+    "OpenWeatherMap": "OpenWeatherMap",
+    "OxfordDictionary": "Oxford",
+    "OxfordLemmas": "Oxford",
+    "OMDb": "OMDb",
+    "UrbanDictionary": "UrbanDictionary",
+    "GoogleCustomSearch": "GoogleCustomSearch",
+    "WolframAlpha": "WolframAlpha",
+    "Reddit": "Reddit"
+}
+
 
 def register_commands(bot: PhotonBot):
+    for provider in sorted(set(PROVIDERS.values())):
+        bot.add_api_provider(provider)
+
+    response_cache = utils.TTLCache(
+        bot.config.getint('Performance', 'WebCacheSize', fallback=1024)
+    )
+    bot.variables["web_response_cache"] = response_cache
+    bot.register_metrics("Web Response Cache", response_cache.stats)
+
+    async def cached(api: str, fetch, *lookup, cache_if=None):
+        # Lookups that only differ in surrounding whitespace, or in case for
+        # some APIs, share an entry. Authentication details are left out of
+        # the key.
+        lookup = [x.strip() if isinstance(x, str) else x for x in lookup]
+        if api in CASE_INSENSITIVE_APIS:
+            lookup = [
+                x.casefold() if isinstance(x, str) else x for x in lookup
+            ]
+        key = (api, *lookup)
+        try:
+            return await response_cache.get(
+                key, fetch, CACHE_TTLS[api], cache_if=cache_if
+            )
+        except ProviderUnavailable:
+            # An expired response is better than none while the API is down
+            response = response_cache.peek(key)
+            if response is None:
+                raise
+            return response
+
+    async def get_json(api: str, url: str, *lookup, headers: dict = None):
+        """
+        Get the JSON response to a request to one of the APIs in `URLS`,
+        using a cached response if the same lookup was made recently. Only
+        successful responses are cached, so that errors such as an invalid
+        API key or an exceeded quota are not remembered once fixed.
+        """
+        _, response = await cached(
+            api, lambda: bot.http_client.get_json(
+                url, headers=headers, provider=PROVIDERS[api],
+                with_status=True
+            ),
+            *lookup, cache_if=lambda x: 200 <= x[0] < 300
+        )
+        return response
+
     @bot.discord_bot.command()
     async def wiki(ctx: ApplicationContext,
                    search: Option(str, "Wikipedia search query")):
@@ -131,9 +217,10 @@ def register_commands(bot: PhotonBot):
             "app_key": bot.config['OxfordDictionaryAuth']['Key']
         }
         try:
-            lemmas_response = requests.get(
-                URLS["OxfordLemmas"].format(word), headers=request_headers
-            ).json()
+            lemmas_response = await get_json(
+                "OxfordLemmas", URLS["OxfordLemmas"].format(word), word,
+                headers=request_headers
+            )
             resolved_word = (
                 lemmas_response['results'][0]['lexicalEntries'][0]
                 ['inflectionOf'][0]['text']
@@ -141,10 +228,11 @@ def register_commands(bot: PhotonBot):
         except IndexError:
             await ctx.respond("I couldn't find that word", ephemeral=True)
             return
-        dictionary_response = requests.get(
-            URLS["OxfordDictionary"].format(resolved_word),
+        dictionary_response = await get_json(
+            "OxfordDictionary",
+            URLS["OxfordDictionary"].format(resolved_word), resolved_word,
             headers=request_headers
-        ).json()
+        )
         if 'error' in dictionary_response:
             await ctx.respond("I couldn't find that word", ephemeral=True)
             return
@@ -235,9 +323,10 @@ def register_commands(bot: PhotonBot):
             "app_key": bot.config['OxfordDictionaryAuth']['Key']
         }
         try:
-            lemmas_response = requests.get(
-                URLS["OxfordLemmas"].format(word), headers=request_headers
-            ).json()
+            lemmas_response = await get_json(
+                "OxfordLemmas", URLS["OxfordLemmas"].format(word), word,
+                headers=request_headers
+            )
             resolved_word = (
                 lemmas_response['results'][0]['lexicalEntries'][0]
                 ['inflectionOf'][0]['text']
@@ -245,10 +334,11 @@ def register_commands(bot: PhotonBot):
         except IndexError:
             await ctx.respond("I couldn't find that word", ephemeral=True)
             return
-        dictionary_response = requests.get(
-            URLS["OxfordDictionary"].format(resolved_word),
+        dictionary_response = await get_json(
+            "OxfordDictionary",
+            URLS["OxfordDictionary"].format(resolved_word), resolved_word,
             headers=request_headers
-        ).json()
+        )
         if 'error' in dictionary_response:
             await ctx.respond("I couldn't find that word", ephemeral=True)
             return
@@ -273,11 +363,13 @@ def register_commands(bot: PhotonBot):
         """
         Get the current weather conditions for cities anywhere in the world
         """
-        city_data = requests.get(
+        city_data = await get_json(
+            "OpenWeatherMap",
             URLS['OpenWeatherMap'].format(
                 bot.config['OpenWeatherMapAuth']['ID'], city
-            )
-        ).json()
+            ),
+            city
+        )
         if city_data["cod"] == '404':
             await ctx.respond("That city could not be found", ephemeral=True)
             return
@@ -352,9 +444,10 @@ def register_commands(bot: PhotonBot):
     async def filmlookup(ctx: ApplicationContext,
             film: Option(str, "The name of the film")):
         """Get information about a particular film or TV show"""
-        film_response = requests.get(
-            URLS["OMDb"].format(bot.config['OMDbAuth']['Key'], film)
-        ).json()
+        film_response = await get_json(
+            "OMDb", URLS["OMDb"].format(bot.config['OMDbAuth']['Key'], film),
+            film
+        )
         if film_response['Response'] == 'False':
             await ctx.respond(film_response['Error'], ephemeral=True)
             return
@@ -444,9 +537,9 @@ def register_commands(bot: PhotonBot):
     async def urban(ctx: ApplicationContext,
             word: Option(str, "The word to search for")):
         """Search for definitions on the Urban dictionary"""
-        urban_response = requests.get(
-            URLS["UrbanDictionary"].format(word)
-        ).json()
+        urban_response = await get_json(
+            "UrbanDictionary", URLS["UrbanDictionary"].format(word), word
+        )
         if len(urban_response['list']) == 0:
             await ctx.respond("No results found", ephemeral=True)
             return
@@ -478,36 +571,88 @@ def register_commands(bot: PhotonBot):
             pages.append(embed)
         await discord.ext.pages.Paginator(pages).respond(ctx.interaction)
 
+    reddit_client = None
+
+    def get_reddit_client():
+        nonlocal reddit_client
+        # Created when first needed, as it must be created inside the event
+        # loop. It is then kept so that it stays authenticated.
+        if reddit_client is None:
+            reddit_client = asyncpraw.Reddit(
+                client_id=bot.config["RedditAuth"]["ClientID"],
+                client_secret=bot.config["RedditAuth"]["ClientSecret"],
+                user_agent=bot.config["RedditAuth"]["UserAgent"],
+                username=bot.config["RedditAuth"]["Username"],
+                password=bot.config["RedditAuth"]["Password"]
+            )
+        return reddit_client
+
+    async def close_reddit_client():
+        if reddit_client is not None:
+            await reddit_client.close()
+
+    bot.add_shutdown_hook(close_reddit_client)
+
+    async def get_reddit_images(subreddit: str):
+        """
+        Get a `(title, url, score, author, over_18)` tuple for each image
+        post currently in the hot listing of a subreddit, or `None` if the
+        subreddit does not exist.
+        """
+        try:
+            subreddit_instance = await get_reddit_client().subreddit(
+                subreddit, fetch=True
+            )
+        except (asyncprawcore.exceptions.NotFound,
+                asyncprawcore.exceptions.Redirect,
+                asyncprawcore.exceptions.Forbidden,
+                asyncprawcore.exceptions.BadRequest, ValueError):
+            return None
+        posts = []
+        async for post in subreddit_instance.hot(limit=50):
+            if (post.selftext != "" or 'i.redd.it' not in post.url
+                    or post.stickied):
+                continue
+            posts.append((
+                post.title, post.url, post.score,
+                post.author.name if post.author is not None else "[deleted]",
+                post.over_18
+            ))
+        return posts
+
     @bot.discord_bot.command()
     async def reddit(ctx: ApplicationContext,
             subreddit: Option(str, "The name of the subreddit")):
         """Get the hot posts from a specified subreddit"""
-        reddit_client = asyncpraw.Reddit(
-            client_id=bot.config["RedditAuth"]["ClientID"],
-            client_secret=bot.config["RedditAuth"]["ClientSecret"],
-            user_agent=bot.config["RedditAuth"]["UserAgent"],
-            username=bot.config["RedditAuth"]["Username"],
-            password=bot.config["RedditAuth"]["Password"]
-        )
+        subreddit = subreddit.strip()
         if subreddit.startswith("r/"):
             subreddit = subreddit[2:]
-        try:
-            subreddit_instance = await reddit_client.subreddit(subreddit, True)
-        except Exception:
+        # Names that cannot exist are not looked up, so that they do not
+        # count as failures of the Reddit API
+        if SUBREDDIT_NAME.fullmatch(subreddit) is None:
+            await ctx.respond(
+                "That subreddit could not be found", ephemeral=True
+            )
+            return
+        posts = await cached(
+            "Reddit",
+            lambda: bot.http_client.providers["Reddit"].run(
+                lambda: get_reddit_images(subreddit)
+            ),
+            subreddit
+        )
+        if posts is None:
             await ctx.respond(
                 "That subreddit could not be found", ephemeral=True
             )
             return
         pages = []
-        async for post in subreddit_instance.hot(limit=50):
-            if (post.selftext != "" or 'i.redd.it' not in post.url
-                    or post.stickied):
-                continue
-            if post.over_18 and not ctx.channel.is_nsfw():
+        for title, url, score, author, over_18 in posts:
+            if over_18 and not ctx.channel.is_nsfw():
                 continue
             embed = discord.Embed(
                 title=f"Reddit Posts from r/{subreddit}",
-                description=f"**Title:** {post.title}",
+                description=f"**Title:** {title}",
                 color=ctx.author.color
             )
             if not ctx.channel.is_nsfw():
@@ -515,10 +660,10 @@ def register_commands(bot: PhotonBot):
                     "\n\nYou are not in an NSFW channel. "
                     + "NSFW posts will not be displayed."
                 )
-            embed.set_image(url=post.url)
+            embed.set_image(url=url)
             embed.set_footer(
-                text=f"{post.score} upvotes • "
-                + f"Posted by u/{post.author.name}"
+                text=f"{score} upvotes • "
+                + f"Posted by u/{author}"
             )
             pages.append(embed)
         if len(pages) == 0:
@@ -533,16 +678,19 @@ def register_commands(bot: PhotonBot):
     async def imagelookup(ctx: ApplicationContext,
             search: Option(str, "The image search term")):
         """Search google images and display the of results"""
-        search_response = requests.get(
+        safe_search = 'off' if ctx.channel.is_nsfw() else 'active'
+        search_response = await get_json(
+            "GoogleCustomSearch",
             URLS["GoogleCustomSearch"].format(
                 bot.config['GoogleCustomSearchAuth']['SearchID'],
-                'off' if ctx.channel.is_nsfw() else 'active',
-                bot.config['GoogleCustomSearchAuth']['Key'],
+                safe_search, bot.config['GoogleCustomSearchAuth']['Key'],
                 search
-            )
-        ).json()
+            ),
+            safe_search, search
+        )
         pages = []
-        for item in search_response['items']:
+        # There are no items if nothing was found
+        for item in search_response.get('items', []):
             if 'image' in item:
                 embed = discord.Embed(
                     title=f"Image Results for {search}",
@@ -569,13 +717,23 @@ def register_commands(bot: PhotonBot):
         wolfram_client = wolframalpha.Client(
             bot.config['WolframAlphaAuth']['Key']
         )
-        wolfram_result = wolfram_client.query(
-            expression, params=(
+        query = functools.partial(
+            wolfram_client.query, expression, params=(
                 ("scantimeout", "60"), ("podtimeout", "60"),
                 ("formattimeout", "60"), ("parsetimeout", "60"),
                 ("totaltimeout", "240")
             )
         )
+        # The client is blocking, so is run outside of the event loop
+        wolfram_result = await cached(
+            "WolframAlpha",
+            lambda: bot.http_client.providers["WolframAlpha"].run(
+                lambda: asyncio.get_running_loop().run_in_executor(
+                    None, query
+                )
+            ),
+            expression
+        )
         if wolfram_result.success == "false":
             await ctx.respond(
                 "Wolfram|Alpha could not understand your request"
@@ -11,6 +11,9 @@ def register_events(bot: PhotonBot):
     @bot.discord_bot.event
     async def on_ready():
         bot.start_time = datetime.datetime.now()
+        guild_ids = [guild.id for guild in bot.discord_bot.guilds]
+        await bot.guild_config_cache.warm(guild_ids)
+        await bot.exp_ledger.reconcile(guild_ids)
         activity_types = [
             ActivityType.playing, ActivityType.listening,
             ActivityType.watching, ActivityType.competing
@@ -1,51 +1,70 @@
 """Events relating to actions revolving around messages."""
-import datetime
+import asyncio
 import random
 
 import discord
+import discord.ext.tasks
 
 import utils
 from photon_bot import PhotonBot
 
 
 def register_events(bot: PhotonBot):
-    bot.variables["exp_grant_cooldowns"] = {}
+    bot.variables["exp_grant_cooldowns"] = utils.CooldownStore(
+        bot.config.getfloat('Performance', 'ExpCooldown', fallback=60.0)
+    )
+    bot.register_metrics(
+        "EXP Cooldowns", bot.variables["exp_grant_cooldowns"].stats
+    )
+
+    @discord.ext.tasks.loop(
+        seconds=bot.config.getfloat(
+            'Performance', 'ExpFlushInterval', fallback=5.0
+        )
+    )
+    async def flush_exp_ledger():
+        try:
+            await bot.exp_ledger.flush()
+        except Exception as error:
+            # Unflushed EXP is kept, so the next iteration will try again
+            print(f"Failed to flush EXP ledger: {error}")
+
+    @discord.ext.tasks.loop(
+        seconds=bot.config.getfloat(
+            'Performance', 'ExpReconcileInterval', fallback=3600.0
+        )
+    )
+    async def reconcile_exp_ledger():
+        try:
+            await bot.exp_ledger.reconcile()
+        except Exception as error:
+            print(f"Failed to reconcile EXP ledger: {error}")
+
+    @reconcile_exp_ledger.before_loop
+    async def wait_for_load():
+        # The ledger is loaded when the bot connects, so the first reconcile
+        # should happen one interval later
+        await bot.discord_bot.wait_until_ready()
+        await asyncio.sleep(reconcile_exp_ledger.seconds)
+
+    flush_exp_ledger.start()
+    reconcile_exp_ledger.start()
+    bot.add_shutdown_hook(bot.exp_ledger.flush)
 
     @bot.discord_bot.event
     async def on_message(message: discord.Message):
         if message.author == bot.discord_bot.user or message.author.bot:
             return
-        guild_config = utils.get_guild_config(
-            bot.config['DatabaseConnection'], message.guild.id
-        )
-        if message.guild.id not in bot.variables["exp_grant_cooldowns"]:
-            bot.variables["exp_grant_cooldowns"][message.guild.id] = {}
-        cooldowns = bot.variables["exp_grant_cooldowns"][message.guild.id]
+        guild_config = await bot.guild_config_cache.get(message.guild.id)
         if ((guild_config.exp_active or guild_config.exp_active is None)
-                and (
-                    message.author.id not in cooldowns
-                    or cooldowns[message.author.id] < datetime.datetime.now()
+                and bot.variables["exp_grant_cooldowns"].try_start(
+                    (message.guild.id, message.author.id)
                 )):
-            cooldowns[message.author.id] = (
-                datetime.datetime.now() + datetime.timedelta(seconds=60)
+            old_exp, new_exp = await bot.exp_ledger.grant(
+                message.guild.id, message.author.id, random.randint(15, 25)
             )
-            old_exp_info = utils.get_exp_info(
-                bot.config['DatabaseConnection'], message.guild.id,
-                message.author.id
-            )
-            new_exp = old_exp_info.exp + random.randint(15, 25)
-            with utils.Database(bot.config['DatabaseConnection']) as database:
-                if not database.modify(
-                        "UPDATE user_exp SET exp = %s "
-                        + "WHERE guild_id = %s AND user_id = %s;",
-                        (new_exp, message.guild.id, message.author.id)):
-                    database.modify(
-                        "INSERT INTO user_exp (guild_id, user_id, exp) "
-                        + "VALUES (%s, %s, %s);",
-                        (message.guild.id, message.author.id, new_exp)
-                    )
             new_level = utils.calculate_level(new_exp)[0]
-            if (new_level > old_exp_info.level
+            if (new_level > utils.calculate_level(old_exp)[0]
                     and guild_config.exp_levelup_channel != 0):
                 if guild_config.exp_levelup_channel is None:
                     channel = message.channel
@@ -1,5 +1,8 @@
 """The task that pushes reminders out to users."""
+import asyncio
 import datetime
+import heapq
+import uuid
 
 import discord
 import discord.ext.tasks
@@ -8,31 +11,300 @@ import utils
 from photon_bot import PhotonBot
 
 
+class ReminderScheduler:
+    """
+    Keeps every reminder due within the next `look_ahead` seconds in a
+    min-heap ordered by due time, with a timer armed for the earliest one so
+    that reminders are pushed as soon as they are due. Reminders further in
+    the future are picked up by `load_window`, which should be called at least
+    once every `look_ahead` seconds.
+
+    Due reminders are sent concurrently, at most `concurrency` at a time.
+    Reminders that cannot be sent are retried after `retry_delay` seconds,
+    doubling after each attempt, and are moved to the `reminders_dead_letter`
+    table after `max_attempts` attempts.
+
+    Several bot processes can share the same reminders table. Before sending,
+    each process claims its due reminders by writing its own lease to them,
+    and only sends the ones it successfully claimed. A lease lasts for
+    `lease_duration` seconds, after which a reminder left behind by a process
+    that stopped can be claimed by another.
+    """
+    def __init__(self, bot: PhotonBot, look_ahead: float, concurrency: int,
+            max_attempts: int, retry_delay: float, lease_duration: float):
+        self._bot = bot
+        self.instance_id = str(uuid.uuid4())
+        self.lease_duration = datetime.timedelta(seconds=lease_duration)
+        self.look_ahead = datetime.timedelta(seconds=look_ahead)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # Entries are (send_datetime, id, user_id, content, attempts,
+        # due_datetime) tuples. IDs are unique, so later fields are never
+        # compared.
+        self._heap = []
+        self._scheduled = set()
+        self._window_end = None
+        self._timer = None
+        # Deliveries in progress are kept here so that they are not garbage
+        # collected before they finish
+        self._deliveries = set()
+        self._window_loads = 0
+        self._delivered = 0
+        self._retried = 0
+        self._dead_lettered = 0
+        self._lost_claims = 0
+        self._total_latency = 0.0
+
+    async def load_window(self):
+        """
+        Load every reminder due before the end of the next look-ahead window
+        into the heap.
+        """
+        # The window is extended before querying so that reminders added
+        # while the query runs are scheduled by `add` instead of being missed
+        now = datetime.datetime.now()
+        self._window_end = now + self.look_ahead
+        async with utils.AsyncDatabase(
+                self._bot.config['DatabaseConnection']) as database:
+            # Reminders currently leased to another process are skipped. They
+            # are loaded again by a later window if their lease runs out.
+            reminder_list = await database.fetch(
+                "SELECT due_datetime, id, user_id, content, attempts "
+                + "FROM reminders WHERE due_datetime <= %s AND "
+                + "(lease_expires IS NULL OR lease_expires < %s "
+                + "OR lease_owner = %s);",
+                (self._window_end, now, self.instance_id)
+            )
+        for reminder in reminder_list:
+            self._push((*reminder, reminder[0]))
+        self._window_loads += 1
+        self._arm()
+
+    def add(self, reminder_id: int, due_datetime: datetime.datetime,
+            user_id: int, content: str):
+        """
+        Schedule a reminder that has just been added to the database, if it is
+        due within the current look-ahead window.
+        """
+        if self._window_end is not None and due_datetime <= self._window_end:
+            self._push((
+                due_datetime, reminder_id, user_id, content, 0, due_datetime
+            ))
+            self._arm()
+
+    def remove(self, reminder_id: int):
+        """Stop a reminder that has been deleted from being pushed."""
+        # The heap entry is skipped when it reaches the top
+        self._scheduled.discard(reminder_id)
+
+    def _push(self, reminder: tuple):
+        if reminder[1] not in self._scheduled:
+            self._scheduled.add(reminder[1])
+            heapq.heappush(self._heap, reminder)
+
+    def _arm(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while len(self._heap) > 0 and self._heap[0][1] not in self._scheduled:
+            heapq.heappop(self._heap)
+        if len(self._heap) > 0:
+            delay = self._heap[0][0] - datetime.datetime.now()
+            self._timer = asyncio.get_running_loop().call_later(
+                max(delay.total_seconds(), 0), self._fire
+            )
+
+    def _fire(self):
+        self._timer = None
+        now = datetime.datetime.now()
+        due_reminders = []
+        while len(self._heap) > 0 and self._heap[0][0] <= now:
+            reminder = heapq.heappop(self._heap)
+            if reminder[1] in self._scheduled:
+                due_reminders.append(reminder)
+        if len(due_reminders) > 0:
+            task = asyncio.ensure_future(self._deliver(due_reminders))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+        self._arm()
+
+    async def _claim(self, due_reminders: list):
+        """
+        Lease as many of the given reminders as possible to this process and
+        return the ones that were claimed.
+        """
+        now = datetime.datetime.now()
+        id_parameters = ", ".join(["%s"] * len(due_reminders))
+        reminder_ids = tuple(x[1] for x in due_reminders)
+        async with utils.AsyncDatabase(
+                self._bot.config['DatabaseConnection']) as database:
+            await database.modify(
+                "UPDATE reminders SET lease_owner = %s, lease_expires = %s "
+                + f"WHERE id IN ({id_parameters}) AND "
+                + "(lease_expires IS NULL OR lease_expires < %s "
+                + "OR lease_owner = %s);",
+                (self.instance_id, now + self.lease_duration, *reminder_ids,
+                    now, self.instance_id)
+            )
+            claimed_ids = {x[0] for x in await database.fetch(
+                f"SELECT id FROM reminders WHERE id IN ({id_parameters}) "
+                + "AND lease_owner = %s;",
+                (*reminder_ids, self.instance_id)
+            )}
+        return [x for x in due_reminders if x[1] in claimed_ids]
+
+    async def _deliver(self, due_reminders: list):
+        try:
+            claimed = await self._claim(due_reminders)
+        except Exception as error:
+            print(f"Failed to claim due reminders: {error}")
+            claimed = []
+        # Reminders that were not claimed have either been deleted, are being
+        # sent by another process, or will be loaded again with the next window
+        for reminder in due_reminders:
+            if reminder not in claimed:
+                self._scheduled.discard(reminder[1])
+        self._lost_claims += len(due_reminders) - len(claimed)
+        due_reminders = claimed
+        if len(due_reminders) == 0:
+            self._arm()
+            return
+        results = await asyncio.gather(
+            *(self._send(x) for x in due_reminders), return_exceptions=True
+        )
+        delivered = []
+        retries = []
+        dead_letters = []
+        for reminder, result in zip(due_reminders, results):
+            if result is True:
+                delivered.append(reminder)
+            elif reminder[4] + 1 >= self.max_attempts:
+                dead_letters.append(reminder)
+            else:
+                retries.append(reminder)
+        try:
+            async with utils.AsyncDatabase(
+                    self._bot.config['DatabaseConnection']) as database:
+                async with database.transaction():
+                    await self._modify_by_id(
+                        database, "DELETE FROM reminders WHERE id IN ({});",
+                        delivered
+                    )
+                    await self._modify_by_id(
+                        database,
+                        "UPDATE reminders SET attempts = attempts + 1, "
+                        + "lease_owner = NULL, lease_expires = NULL "
+                        + "WHERE id IN ({});", retries
+                    )
+                    await self._modify_by_id(
+                        database,
+                        "INSERT INTO reminders_dead_letter (id, due_datetime, "
+                        + "user_id, content, attempts, failed_datetime) "
+                        + "SELECT id, due_datetime, user_id, content, "
+                        + "attempts + 1, %s FROM reminders "
+                        + "WHERE id IN ({});", dead_letters,
+                        (datetime.datetime.now(),)
+                    )
+                    await self._modify_by_id(
+                        database, "DELETE FROM reminders WHERE id IN ({});",
+                        dead_letters
+                    )
+        except Exception as error:
+            # Every reminder is left to be loaded again with the next window
+            print(f"Failed to update delivered reminders: {error}")
+            for reminder in due_reminders:
+                self._scheduled.discard(reminder[1])
+            self._arm()
+            return
+        for reminder in delivered + dead_letters:
+            self._scheduled.discard(reminder[1])
+        now = datetime.datetime.now()
+        for reminder in delivered:
+            self._total_latency += (now - reminder[5]).total_seconds()
+        for (_, reminder_id, user_id, content, attempts,
+                due_datetime) in retries:
+            retry_datetime = now + datetime.timedelta(
+                seconds=self.retry_delay * 2 ** attempts
+            )
+            heapq.heappush(self._heap, (
+                retry_datetime, reminder_id, user_id, content, attempts + 1,
+                due_datetime
+            ))
+        self._delivered += len(delivered)
+        self._retried += len(retries)
+        self._dead_lettered += len(dead_letters)
+        self._arm()
+
+    @staticmethod
+    async def _modify_by_id(database: utils.AsyncDatabase, statement: str,
+            reminders: list, parameters: tuple = ()):
+        if len(reminders) > 0:
+            await database.modify(
+                statement.format(", ".join(["%s"] * len(reminders))),
+                (*parameters, *(x[1] for x in reminders))
+            )
+
+    async def _send(self, reminder: tuple):
+        async with self._semaphore:
+            user = self._bot.discord_bot.get_user(reminder[2])
+            try:
+                if user is None:
+                    user = await self._bot.discord_bot.fetch_user(reminder[2])
+                await user.send(
+                    "**Hey!** You asked me to remind you about this:"
+                    + f"\n```{reminder[3]}```"
+                )
+            except discord.HTTPException:
+                # Includes users that could not be found and closed DMs
+                return False
+        return True
+
+    def stats(self):
+        """Get the number of scheduled reminders and how late they were."""
+        return {
+            "scheduled": len(self._scheduled),
+            "window_loads": self._window_loads,
+            "delivered": self._delivered,
+            "retried": self._retried,
+            "dead_lettered": self._dead_lettered,
+            "lost_claims": self._lost_claims,
+            "average_latency": self._total_latency / self._delivered
+            if self._delivered else 0.0
+        }
+
+
 def register_tasks(bot: PhotonBot):
-    @discord.ext.tasks.loop(seconds=60)
+    scheduler = ReminderScheduler(
+        bot,
+        bot.config.getfloat(
+            'Performance', 'ReminderLookAhead', fallback=600.0
+        ),
+        bot.config.getint(
+            'Performance', 'ReminderConcurrency', fallback=5
+        ),
+        bot.config.getint(
+            'Performance', 'ReminderMaxAttempts', fallback=5
+        ),
+        bot.config.getfloat(
+            'Performance', 'ReminderRetryDelay', fallback=60.0
+        ),
+        bot.config.getfloat(
+            'Performance', 'ReminderLeaseDuration', fallback=300.0
+        )
+    )
+    bot.variables["reminder_scheduler"] = scheduler
+    bot.register_metrics("Reminders", scheduler.stats)
+
+    # Windows overlap so that no reminder is loaded late
+    @discord.ext.tasks.loop(seconds=scheduler.look_ahead.total_seconds() / 2)
     async def push_reminders():
-        with utils.Database(bot.config['DatabaseConnection']) as database:
-            reminder_list = database.fetch(
-                "SELECT due_datetime, user_id, content FROM reminders "
-                + "WHERE due_datetime <= %s;", (datetime.datetime.now(),)
-            )
-            for reminder in reminder_list:
-                user = bot.discord_bot.get_user(reminder[1])
-                if user is not None:
-                    successful = True
-                    try:
-                        await user.send(
-                            "**Hey!** You asked me to remind you about this:"
-                            + f"\n```{reminder[2]}```"
-                        )
-                    except discord.Forbidden:
-                        successful = False
-                    if successful:
-                        database.modify(
-                            "DELETE FROM reminders WHERE due_datetime = %s "
-                            + "AND user_id = %s AND content = %s LIMIT 1;",
-                            reminder
-                        )
+        try:
+            await scheduler.load_window()
+        except Exception as error:
+            # Reminders that were missed are loaded by the next window, which
+            # overlaps this one
+            print(f"Failed to load reminders: {error}")
 
     @push_reminders.before_loop
     async def wait_for_ready():
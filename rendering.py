@@ -0,0 +1,407 @@
+"""
+Functions for drawing the images sent by the ranking commands, and a service
+that runs them in separate processes. Drawing functions only take and return
+plain data so that they can be sent to worker processes.
+"""
+import asyncio
+import collections
+import functools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+RESOURCES_PATH = os.path.join(os.path.dirname(__file__), "resources")
+FONT_PATH = os.path.join(RESOURCES_PATH, "fonts", "DejaVuSans.ttf")
+RANK_CARD_SIZE = (512, 630)
+# Avatars are passed to the drawing functions already resized to these sizes
+RANK_CARD_AVATAR_SIZE = 192
+LEADERBOARD_AVATAR_SIZE = 95
+
+IMAGE_FORMATS = ("png", "png-palette", "webp")
+ImageEncoding = collections.namedtuple(
+    'ImageEncoding', ['format', 'compress_level', 'quality'],
+    defaults=("png", 6, 90)
+)
+
+
+class Assets:
+    """
+    The images and fonts used for rendering, decoded once so that they do not
+    have to be read from disk every time an image is drawn. Images in the
+    registry are shared, so must be copied before being modified.
+    """
+    def __init__(self):
+        self.rank_card_template = self._load("RankCardTemplate.png")
+        self.rank_card_mask = self._load("RankCardMask.png").convert(mode="1")
+        # The mask is drawn at the rank card size
+        self.avatar_mask = self._load("AvatarMask.png")
+        self.leaderboard_avatar_mask = self.avatar_mask.resize(
+            (LEADERBOARD_AVATAR_SIZE, LEADERBOARD_AVATAR_SIZE), Image.LANCZOS
+        )
+        self.leaderboard_template = self._load("LeaderboardTemplate.png")
+
+    @staticmethod
+    def _load(file_name: str):
+        image = Image.open(os.path.join(RESOURCES_PATH, "images", file_name))
+        image.load()
+        return image
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def font(size: int):
+        """Get the font used on rendered images at a particular size."""
+        return ImageFont.truetype(FONT_PATH, size)
+
+
+@functools.lru_cache(maxsize=1)
+def get_assets():
+    """
+    Get the shared asset registry, loading it if this is the first time it
+    has been requested.
+    """
+    return Assets()
+
+
+@functools.lru_cache(maxsize=128)
+def _rank_card_background(color: tuple):
+    background = Image.new("RGBA", RANK_CARD_SIZE, color)
+    assets = get_assets()
+    background.paste(
+        assets.rank_card_template, mask=assets.rank_card_mask
+    )
+    return background
+
+
+def _decode_avatar(avatar_data: bytes, size: int):
+    return Image.frombytes("RGBA", (size, size), avatar_data)
+
+
+def _paste_avatar(image: Image.Image, avatar: Image.Image,
+        avatar_mask: Image.Image, box: tuple):
+    avatar_mask = avatar_mask.copy()
+    avatar_mask.paste(avatar, mask=avatar_mask)
+    image.paste(avatar, box=box, mask=avatar_mask)
+
+
+def encode_image(image: Image.Image, encoding: ImageEncoding):
+    """
+    Encode an image with the settings in an `ImageEncoding` tuple and return
+    the data. The format can be `png`, `png-palette`, which reduces the
+    image to 256 colors first, or lossy `webp`. `compress_level` is used for
+    PNG images (0 to 9) and `quality` for WebP ones (0 to 100).
+    """
+    output = BytesIO()
+    if encoding.format == "webp":
+        image.save(output, "WEBP", quality=encoding.quality)
+    else:
+        if encoding.format == "png-palette":
+            image = image.convert(mode="RGBA").quantize(
+                method=Image.FASTOCTREE
+            )
+        image.save(output, "PNG", compress_level=encoding.compress_level)
+    return output.getvalue()
+
+
+def file_extension(encoding: ImageEncoding):
+    """Get the file extension for images encoded with `encode_image`."""
+    return "webp" if encoding.format == "webp" else "png"
+
+
+def render_rank_card(avatar_data: bytes, color: tuple, name: str,
+        exp_info: dict, encoding: ImageEncoding = ImageEncoding()):
+    """
+    Draw the rank card for a user and encode it with `encode_image`.
+    `avatar_data` should be raw RGBA data for an avatar
+    `RANK_CARD_AVATAR_SIZE` pixels square, and `exp_info` a dictionary of the
+    fields in a `utils.ExpInfo` tuple. If `color` is `None`, the average color
+    of the avatar is used. The background for each color is cached, so only
+    the avatar and text are drawn on every call.
+    """
+    assets = get_assets()
+    avatar = _decode_avatar(avatar_data, RANK_CARD_AVATAR_SIZE)
+    if color is None:
+        color = avatar.convert(mode="RGB").resize((1, 1)).getpixel((0, 0))
+    color = tuple(color)
+    rank_card = _rank_card_background(color).copy()
+    _paste_avatar(
+        rank_card, avatar, assets.avatar_mask, (24, 45, 216, 237)
+    )
+    card_draw = ImageDraw.Draw(rank_card)
+    card_draw.text(
+        (250, 143), str(exp_info["level"]), fill=color, font=assets.font(72)
+    )
+    card_draw.text((24, 270), name, fill=color, font=assets.font(60))
+    card_draw.text(
+        (24, 353), str(exp_info["exp"]), fill=color, font=assets.font(48)
+    )
+    card_draw.text(
+        (24, 429), str(exp_info["rank"]), fill=color, font=assets.font(48)
+    )
+    card_draw.text(
+        (24, 566), str(exp_info["remaining"]), fill=color,
+        font=assets.font(30)
+    )
+    card_draw.text(
+        (372, 566), str(exp_info["next_level"]), fill=color,
+        font=assets.font(30)
+    )
+    card_draw.rectangle(
+        (
+            (23, 509),
+            (23 + round(
+                463 * (exp_info["remaining"] / exp_info["next_level"])
+            ), 549)
+        ),
+        fill=color
+    )
+    return encode_image(rank_card, encoding)
+
+
+def render_leaderboard(top_lineup: list, bottom_lineup: list,
+        encoding: ImageEncoding = ImageEncoding(), start: int = 0):
+    """
+    Draw a guild leaderboard and encode it with `encode_image`.
+    `top_lineup` should contain up to 5 `(avatar_data, name, exp, level)`
+    tuples, and `bottom_lineup` the avatar data for up to 10 more users.
+    Avatars should be raw RGBA data `LEADERBOARD_AVATAR_SIZE` pixels square.
+    `start` is the 0-based position of the first user in `top_lineup`, as
+    only the top 3 positions are drawn in their medal colors.
+    """
+    assets = get_assets()
+    board = assets.leaderboard_template
+    if len(bottom_lineup) == 0:
+        board = board.crop((0, 0, 1260, 540))
+    if len(top_lineup) < 5:
+        board = board.crop(
+            (0, 0, 1260, 540 - (108 * (5 - len(top_lineup))))
+        )
+    board = board.copy()
+    for index in range(len(top_lineup)):
+        position = start + index
+        if position < 3:
+            continue
+        # Positions below the top 3 alternate between the plain styles of
+        # the 4th and 5th rows of the template
+        template_row = 3 + (position - 3) % 2
+        if template_row != index:
+            board.paste(
+                assets.leaderboard_template.crop(
+                    (0, template_row * 108, 1260, (template_row + 1) * 108)
+                ),
+                (0, index * 108)
+            )
+    board_draw = ImageDraw.Draw(board)
+    for index, (avatar_data, name, exp, level) in enumerate(top_lineup):
+        _paste_avatar(
+            board, _decode_avatar(avatar_data, LEADERBOARD_AVATAR_SIZE),
+            assets.leaderboard_avatar_mask,
+            (17, 7 + (index * 108), 112, 102 + (index * 108))
+        )
+        board_draw.text(
+            (140, 33 + (index * 108)), name, fill=(0, 0, 0),
+            font=assets.font(35)
+        )
+        board_draw.text(
+            (900, 2 + (index * 108)), str(exp), fill=(0, 0, 0),
+            font=assets.font(40)
+        )
+        board_draw.text(
+            (900, 55 + (index * 108)), str(level), fill=(0, 0, 0),
+            font=assets.font(40)
+        )
+    for index, avatar_data in enumerate(bottom_lineup):
+        _paste_avatar(
+            board, _decode_avatar(avatar_data, LEADERBOARD_AVATAR_SIZE),
+            assets.leaderboard_avatar_mask,
+            (90 + (index * 108), 546, 185 + (index * 108), 641)
+        )
+    return encode_image(board, encoding)
+
+
+class RenderCache:
+    """
+    A cache of encoded images, keyed by every input that was used to draw
+    them, designed for use with PhotonBot. Because the key changes whenever
+    the data shown in an image does, such as a user's EXP or card color,
+    stale images are never returned and entries do not need to be
+    invalidated. The least recently used images are removed once there are
+    more than `max_entries`.
+    """
+    def __init__(self, max_entries: int = 256):
+        """Create an empty cache."""
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: tuple):
+        """Get a cached image, or `None` if it is not cached."""
+        data = self._entries.get(key)
+        if data is None:
+            self._misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return data
+
+    def set(self, key: tuple, data: bytes):
+        """Cache an image."""
+        self._entries[key] = data
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def stats(self):
+        """Get the number and size of cached images and how often they hit."""
+        return {
+            "entries": len(self._entries),
+            "bytes": sum(len(x) for x in self._entries.values()),
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions
+        }
+
+
+def _warm_up():
+    # Does nothing, but starts a worker process, which loads the assets
+    pass
+
+
+def _timed(func, *args):
+    start_time = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start_time
+
+
+class Renderer:
+    """
+    Runs drawing functions in a pool of worker processes so that rendering
+    never blocks the event loop, designed for use with PhotonBot. Each worker
+    loads its own copy of the asset registry when it starts. If a worker
+    dies, such as by being killed for using too much memory, the pool is
+    replaced and the render is tried once more.
+    """
+    def __init__(self, workers: int = 2,
+            encoding: ImageEncoding = ImageEncoding()):
+        """
+        Create a renderer with up to `workers` worker processes that encodes
+        images with the settings in `encoding`.
+        """
+        if encoding.format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown image format: {encoding.format}")
+        self.workers = max(workers, 1)
+        self.encoding = encoding
+        self.extension = file_extension(encoding)
+        self._executor = self._create_executor()
+        self._pending = 0
+        self._renders = 0
+        self._failures = 0
+        self._restarts = 0
+        self._total_render_time = 0.0
+        self._max_render_time = 0.0
+        self._total_wait = 0.0
+
+    def _create_executor(self):
+        # Worker processes are started fresh rather than forked so that they
+        # do not inherit the event loop or the database pool's threads
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=get_assets
+        )
+
+    def start(self):
+        """
+        Start every worker process without waiting for them, so that the
+        assets are already loaded by the time the first image is rendered.
+        """
+        # A process is started for each task submitted while none are idle
+        for _ in range(self.workers):
+            self._executor.submit(_warm_up)
+
+    def _restart(self, broken_executor: ProcessPoolExecutor):
+        # Renders that failed together only replace the pool once
+        if self._executor is not broken_executor:
+            return
+        broken_executor.shutdown(wait=False)
+        self._executor = self._create_executor()
+        self._restarts += 1
+        self.start()
+
+    async def render(self, func, *args):
+        """
+        Run a drawing function from this module in a worker process and
+        return the encoded image data.
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(_timed, func, *args)
+        self._pending += 1
+        start_time = time.monotonic()
+        try:
+            executor = self._executor
+            try:
+                result, render_time = await loop.run_in_executor(
+                    executor, call
+                )
+            except BrokenProcessPool as error:
+                print(f"Render worker died, restarting workers: {error}")
+                self._restart(executor)
+                result, render_time = await loop.run_in_executor(
+                    self._executor, call
+                )
+        except BaseException:
+            self._failures += 1
+            raise
+        finally:
+            self._pending -= 1
+        self._renders += 1
+        self._total_render_time += render_time
+        self._max_render_time = max(self._max_render_time, render_time)
+        self._total_wait += time.monotonic() - start_time - render_time
+        return result
+
+    async def rank_card(self, avatar_data: bytes, color: tuple, name: str,
+            exp_info: dict):
+        """Render a rank card. See `render_rank_card`."""
+        return await self.render(
+            render_rank_card, avatar_data, color, name, exp_info,
+            self.encoding
+        )
+
+    async def leaderboard(self, top_lineup: list, bottom_lineup: list,
+            start: int = 0):
+        """Render a guild leaderboard. See `render_leaderboard`."""
+        return await self.render(
+            render_leaderboard, top_lineup, bottom_lineup, self.encoding,
+            start
+        )
+
+    def stats(self):
+        """
+        Get the number of images waiting to be rendered and how long
+        rendering has taken, in seconds.
+        """
+        return {
+            "workers": self.workers,
+            "in_progress": min(self._pending, self.workers),
+            "queue_depth": max(self._pending - self.workers, 0),
+            "renders": self._renders,
+            "failures": self._failures,
+            "worker_restarts": self._restarts,
+            "average_render_time": self._total_render_time / self._renders
+            if self._renders else 0.0,
+            "max_render_time": self._max_render_time,
+            "average_queue_time": self._total_wait / self._renders
+            if self._renders else 0.0
+        }
+
+    def close(self):
+        """Stop the worker processes once any running renders finish."""
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,109 @@
+"""
+Tests for the reminders task, run against a temporary SQLite database.
+
+Usage:
+    python -m unittest discover tests
+"""
+import asyncio
+import collections
+import configparser
+import datetime
+import os
+import random
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+from plugins.tasks.reminders import ReminderScheduler
+
+REMINDER_COUNT = 500
+
+
+class FakeUser:
+    def __init__(self, user_id: int, sent: collections.Counter):
+        self.id = user_id
+        self._sent = sent
+
+    async def send(self, content: str):
+        # Give the other scheduler a chance to run mid-delivery
+        await asyncio.sleep(random.random() * 0.005)
+        self._sent[(self.id, content)] += 1
+
+
+class FakeDiscordBot:
+    def __init__(self):
+        self.sent = collections.Counter()
+
+    def get_user(self, user_id: int):
+        return FakeUser(user_id, self.sent)
+
+
+class TestReminderLeases(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        config = configparser.ConfigParser()
+        config.read_dict({"DatabaseConnection": {
+            "Backend": "sqlite",
+            "Path": os.path.join(self.directory.name, "reminders.db"),
+            "PoolMaxSize": "10"
+        }})
+        self.database_config = config['DatabaseConnection']
+        utils.run_migrations(
+            self.database_config, "core",
+            os.path.join(os.path.dirname(utils.__file__), "migrations")
+        )
+
+    async def asyncTearDown(self):
+        utils.get_pool(self.database_config).close()
+        self.directory.cleanup()
+
+    async def test_two_schedulers_deliver_exactly_once(self):
+        now = datetime.datetime.now()
+        async with utils.AsyncDatabase(self.database_config) as database:
+            await database.modify_many(
+                "INSERT INTO reminders (due_datetime, user_id, content) "
+                + "VALUES (%s, %s, %s);",
+                [
+                    (now - datetime.timedelta(seconds=1), x, f"Reminder {x}")
+                    for x in range(REMINDER_COUNT)
+                ]
+            )
+        discord_bot = FakeDiscordBot()
+        # Two bot processes sharing the same database, each with its own
+        # scheduler and lease ID
+        schedulers = [
+            ReminderScheduler(
+                types.SimpleNamespace(
+                    config={"DatabaseConnection": self.database_config},
+                    discord_bot=discord_bot
+                ),
+                look_ahead=600, concurrency=5, max_attempts=5,
+                retry_delay=60, lease_duration=300
+            )
+            for _ in range(2)
+        ]
+        await asyncio.gather(*(x.load_window() for x in schedulers))
+
+        for _ in range(200):
+            await asyncio.sleep(0.05)
+            async with utils.AsyncDatabase(self.database_config) as database:
+                remaining = (await database.fetch(
+                    "SELECT COUNT(*) FROM reminders;"
+                ))[0][0]
+            if remaining == 0 and not any(x._deliveries for x in schedulers):
+                break
+
+        self.assertEqual(remaining, 0)
+        self.assertEqual(len(discord_bot.sent), REMINDER_COUNT)
+        self.assertEqual(set(discord_bot.sent.values()), {1})
+        self.assertEqual(
+            sum(x.stats()["delivered"] for x in schedulers), REMINDER_COUNT
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,19 @@
 """Utility functions provided to make repeated actions easier."""
+import asyncio
+import bisect
 import collections
+import contextlib
+import datetime
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 
-import mariadb
+import numpy
 
 ExpInfo = collections.namedtuple(
     'ExpInfo', ['exp', 'level', 'remaining', 'rank', 'next_level', 'color']
@@ -14,6 +25,32 @@ GuildConfig = collections.namedtuple(
     ], defaults=(None,) * 2
 )
 
+PoolStats = collections.namedtuple(
+    'PoolStats', [
+        "size",
+        "in_use",
+        "idle",
+        "max_size",
+        "utilisation",
+        "acquisitions",
+        "timeouts",
+        "average_wait",
+        "max_wait"
+    ]
+)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# SQLite has no date and time types of its own, so they are stored as ISO 8601
+# text and converted back for columns declared as `datetime`
+sqlite3.register_adapter(
+    datetime.datetime, lambda x: x.isoformat(sep=" ")
+)
+sqlite3.register_converter(
+    "datetime", lambda x: datetime.datetime.fromisoformat(x.decode())
+)
+
 
 def get_all_words():
     """Get a list of almost every word in the English language."""
@@ -21,23 +58,388 @@ def get_all_words():
         return file.read().splitlines()
 
 
+class MariaDBBackend:
+    """
+    Connects to a MariaDB server, version 10.1.4 or greater. MySQL is not
+    supported, as migrations use `IF NOT EXISTS` with `CREATE INDEX` and
+    `ADD COLUMN`. This is the default backend, used when `Backend` is
+    `mariadb` or is not given in the `DatabaseConnection` section of the
+    config file. The `mariadb` package is only imported when this backend is
+    used, so it does not need to be installed for SQLite.
+    """
+    def __init__(self, database_config: ConfigParser):
+        import mariadb
+        self._mariadb = mariadb
+        self.Error = mariadb.Error
+        self._database_config = database_config
+        self.key = (
+            "mariadb", database_config['Host'], database_config['Username'],
+            database_config['DatabaseName']
+        )
+
+    def connect(self):
+        """Open a new connection to the database server."""
+        return self._mariadb.connect(
+            host=self._database_config['Host'],
+            user=self._database_config['Username'],
+            password=self._database_config['Password'],
+            database=self._database_config['DatabaseName']
+        )
+
+    @staticmethod
+    def cursor(connection):
+        """Create a cursor that fetches every row of a result at once."""
+        return connection.cursor(buffered=True)
+
+    @staticmethod
+    def ping(connection):
+        """Raise `Error` if a connection is no longer usable."""
+        connection.ping()
+
+    @staticmethod
+    def begin(_):
+        """
+        Start a transaction. Connections are not in autocommit mode, so one is
+        already started implicitly by the first statement.
+        """
+
+    @staticmethod
+    def translate(statement: str):
+        """Convert a statement written for MariaDB to this backend."""
+        return statement
+
+    @staticmethod
+    def upsert_statement(table: str, key_columns: list, value_columns: list,
+            increment: bool):
+        """Build the statement used by `Database.upsert`."""
+        columns = key_columns + value_columns
+        if increment:
+            updates = [f"{x} = {x} + VALUES({x})" for x in value_columns]
+        else:
+            updates = [f"{x} = VALUES({x})" for x in value_columns]
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            + f"VALUES ({', '.join(['%s'] * len(columns))}) "
+            + f"ON DUPLICATE KEY UPDATE {', '.join(updates)};"
+        )
+
+    @staticmethod
+    def migrations_directory(directory: str):
+        """Get the directory that migrations for this backend are kept in."""
+        return directory
+
+
+class SQLiteBackend:
+    """
+    Stores the database in a single local file with SQLite, for deployments
+    that run a single bot process and do not want a separate database server.
+    Used when `Backend` is `sqlite` in the `DatabaseConnection` section of the
+    config file, with the file given by `Path`. The database is opened in WAL
+    mode so that reads are never blocked by a write.
+
+    Statements are written for MariaDB everywhere else in the bot, so
+    placeholders are converted from `%s` to `?` before being run. Features
+    without a direct equivalent, such as upserts and `ALTER TABLE` changes in
+    migrations, have SQLite versions provided instead.
+    """
+    Error = sqlite3.Error
+
+    def __init__(self, database_config: ConfigParser):
+        self._database_config = database_config
+        self.path = database_config['Path']
+        self.busy_timeout = database_config.getfloat('PoolTimeout', 10.0)
+        self.key = ("sqlite", os.path.abspath(self.path))
+
+    def connect(self):
+        """Open a new connection to the database file."""
+        # Transactions are started explicitly by `begin`, and connections are
+        # only ever used by one thread at a time while borrowed from the pool
+        connection = sqlite3.connect(
+            self.path, timeout=self.busy_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None,
+            check_same_thread=False, cached_statements=256
+        )
+        connection.execute("PRAGMA journal_mode=WAL;")
+        connection.execute("PRAGMA synchronous=NORMAL;")
+        return connection
+
+    @staticmethod
+    def cursor(connection):
+        """Create a cursor for a connection."""
+        return connection.cursor()
+
+    @staticmethod
+    def ping(connection):
+        """Raise `Error` if a connection is no longer usable."""
+        connection.execute("SELECT 1;")
+
+    @staticmethod
+    def begin(connection):
+        """Start a transaction."""
+        if not connection.in_transaction:
+            connection.execute("BEGIN;")
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def translate(statement: str):
+        """Convert a statement written for MariaDB to this backend."""
+        return statement.replace("%s", "?")
+
+    @staticmethod
+    def upsert_statement(table: str, key_columns: list, value_columns: list,
+            increment: bool):
+        """Build the statement used by `Database.upsert`."""
+        columns = key_columns + value_columns
+        if increment:
+            updates = [f"{x} = {x} + excluded.{x}" for x in value_columns]
+            condition = ""
+        else:
+            updates = [f"{x} = excluded.{x}" for x in value_columns]
+            # Rows that would not change are not counted as modified, to
+            # match MariaDB
+            condition = " WHERE " + " OR ".join(
+                f"{x} IS NOT excluded.{x}" for x in value_columns
+            )
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            + f"VALUES ({', '.join(['?'] * len(columns))}) "
+            + f"ON CONFLICT ({', '.join(key_columns)}) "
+            + f"DO UPDATE SET {', '.join(updates)}{condition};"
+        )
+
+    @staticmethod
+    def migrations_directory(directory: str):
+        """
+        Get the directory that migrations for this backend are kept in. This
+        is the `sqlite` subdirectory if there is one, otherwise migrations are
+        assumed to work with both backends.
+        """
+        sqlite_directory = os.path.join(directory, "sqlite")
+        if os.path.isdir(sqlite_directory):
+            return sqlite_directory
+        return directory
+
+
+BACKENDS = {
+    "mariadb": MariaDBBackend,
+    "sqlite": SQLiteBackend
+}
+
+
+def get_backend(database_config: ConfigParser):
+    """
+    Create the storage backend selected by the `Backend` key in the
+    `DatabaseConnection` section of the config file.
+    """
+    name = database_config.get('Backend', "mariadb").strip().lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown database backend: {name}")
+    return BACKENDS[name](database_config)
+
+
+class PoolError(Exception):
+    """Raised when a connection cannot be taken from a `ConnectionPool`."""
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of database connections, designed for use with
+    PhotonBot. Connections are opened on demand up to a maximum size and are
+    reused once released instead of being closed. Pools should be obtained
+    with `get_pool` rather than being created directly.
+    """
+    def __init__(self, database_config: ConfigParser):
+        """
+        Create a pool using the connection details and pool settings in the
+        `DatabaseConnection` section of the config file. `PoolMinSize`
+        connections are opened immediately.
+        """
+        self.backend = get_backend(database_config)
+        self.min_size = database_config.getint('PoolMinSize', 1)
+        self.max_size = max(
+            database_config.getint('PoolMaxSize', 10), self.min_size, 1
+        )
+        self.timeout = database_config.getfloat('PoolTimeout', 10.0)
+        self.health_check_interval = database_config.getfloat(
+            'PoolHealthCheckInterval', 30.0
+        )
+        self._condition = threading.Condition()
+        # Idle connections are stored alongside the time they were released
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._acquisitions = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._closed = False
+        # Statements from coroutines are run on these threads. Holding one
+        # semaphore slot per borrowed connection means there can never be
+        # more asynchronous borrowers than there are threads to serve them.
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_size, thread_name_prefix="database"
+        )
+        self.semaphore = asyncio.Semaphore(self.max_size)
+        for _ in range(self.min_size):
+            self._size += 1
+            self._idle.append((self.backend.connect(), time.monotonic()))
+
+    def acquire(self, timeout: float = None):
+        """
+        Take a connection from the pool, opening a new one if none are idle
+        and the pool is not full. If the pool is full, wait up to `timeout`
+        seconds (defaulting to `PoolTimeout`) for a connection to be released
+        before raising `PoolError`. Idle connections that have not
+        been used within `PoolHealthCheckInterval` seconds are pinged first and
+        replaced if they are no longer alive.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        start_time = time.monotonic()
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolError("Connection pool is closed")
+                if len(self._idle) > 0:
+                    connection, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    connection, last_used = None, None
+                    break
+                remaining = start_time + timeout - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolError(
+                        "Timed out waiting for a database connection"
+                    )
+                self._condition.wait(remaining)
+            self._in_use += 1
+            wait_time = time.monotonic() - start_time
+            self._acquisitions += 1
+            self._total_wait += wait_time
+            self._max_wait = max(self._max_wait, wait_time)
+        try:
+            if connection is None:
+                connection = self.backend.connect()
+            elif (time.monotonic() - last_used
+                    >= self.health_check_interval):
+                try:
+                    self.backend.ping(connection)
+                except self.backend.Error:
+                    self._close_quietly(connection)
+                    connection = self.backend.connect()
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+        return connection
+
+    def release(self, connection, discard: bool = False):
+        """
+        Return a connection to the pool. Any uncommitted changes are rolled
+        back. If `discard` is `True`, or the connection can no longer be used,
+        it will be closed instead of being reused.
+        """
+        if not discard:
+            try:
+                connection.rollback()
+            except self.backend.Error:
+                discard = True
+        with self._condition:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((connection, time.monotonic()))
+                connection = None
+            self._condition.notify()
+        if connection is not None:
+            self._close_quietly(connection)
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run a blocking function on one of the pool's worker threads and
+        return its result without blocking the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+    def stats(self):
+        """
+        Get the current size and utilisation of the pool, along with how long
+        callers have had to wait to acquire a connection, in seconds.
+        """
+        with self._condition:
+            return PoolStats(
+                self._size, self._in_use, len(self._idle), self.max_size,
+                self._in_use / self.max_size, self._acquisitions,
+                self._timeouts,
+                self._total_wait / self._acquisitions
+                if self._acquisitions else 0.0,
+                self._max_wait
+            )
+
+    def close(self):
+        """
+        Close every idle connection and stop new connections being acquired.
+        Connections currently in use are closed when they are released. The
+        next call to `get_pool` for the same database creates a new pool.
+        """
+        with _pools_lock:
+            if _pools.get(self.backend.key) is self:
+                del _pools[self.backend.key]
+        with self._condition:
+            self._closed = True
+            idle = self._idle
+            self._size -= len(idle)
+            self._idle = []
+            self._condition.notify_all()
+        for connection, _ in idle:
+            self._close_quietly(connection)
+        self.executor.shutdown(wait=False)
+
+    def _close_quietly(self, connection):
+        try:
+            connection.close()
+        except self.backend.Error:
+            pass
+
+
+def get_pool(database_config: ConfigParser):
+    """
+    Get the shared connection pool for the database specified in the
+    `DatabaseConnection` section of the config file, creating it if it does
+    not yet exist or has been closed.
+    """
+    key = get_backend(database_config).key
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(database_config)
+        return _pools[key]
+
+
 class Database:
     """
-    A basic wrapper for MariaDB with context manager support,
-    designed for use with PhotonBot.
+    A basic wrapper for the bot database with context manager support,
+    designed for use with PhotonBot. Statements should be written for MariaDB
+    and are converted by the configured backend. Connections are borrowed
+    from the shared connection pool and returned to it when the wrapper is
+    closed.
     """
     def __init__(self, database_config: ConfigParser):
         """
-        Opens a connection to a database with the details specified in the
+        Acquire a connection to a database with the details specified in the
         `DatabaseConnection` section of the config file.
         """
-        self._database = mariadb.connect(
-            host=database_config['Host'],
-            user=database_config['Username'],
-            password=database_config['Password'],
-            database=database_config['DatabaseName']
-        )
-        self._cursor = self._database.cursor(buffered=True)
+        self._pool = get_pool(database_config)
+        self._backend = self._pool.backend
+        self._database = self._pool.acquire()
+        self._cursor = self._backend.cursor(self._database)
+        self.in_transaction = False
 
     def __enter__(self):
         return self
@@ -46,43 +448,605 @@ class Database:
         self.close()
         return False
 
-    def fetch(self, *args, **kwargs) -> list[tuple]:
+    def fetch(self, statement: str, *args, **kwargs) -> list[tuple]:
         """
         Execute an SQL statement and return the result. Designed for statements
         using `SELECT`.
         """
-        self._cursor.execute(*args, **kwargs)
+        self._cursor.execute(
+            self._backend.translate(statement), *args, **kwargs
+        )
         return self._cursor.fetchall()
 
-    def modify(self, *args, **kwargs) -> int:
+    def modify(self, statement: str, *args, **kwargs) -> int:
         """
         Execute an SQL statement and return the number of rows modified.
         Designed for statements such as `UPDATE`, `INSERT` and `DELETE`.
-        Modifications are automatically committed to the database server.
+        Modifications are automatically committed to the database server
+        unless a transaction is in progress.
         """
-        self._cursor.execute(*args, **kwargs)
-        self._database.commit()
+        self._cursor.execute(
+            self._backend.translate(statement), *args, **kwargs
+        )
+        if not self.in_transaction:
+            self._database.commit()
+        return self._cursor.rowcount
+
+    def insert(self, *args, **kwargs) -> int:
+        """
+        Execute an SQL `INSERT` statement and return the auto-increment ID of
+        the inserted row. Modifications are committed the same way as with
+        `modify`.
+        """
+        self.modify(*args, **kwargs)
+        return self._cursor.lastrowid
+
+    def modify_many(self, statement: str, parameters) -> int:
+        """
+        Execute an SQL statement once for every sequence of parameters in
+        `parameters` and return the total number of rows modified. The
+        parameters are sent to the database server in bulk, so this takes a
+        single round trip. Modifications are committed the same way as with
+        `modify`.
+        """
+        parameters = list(parameters)
+        if len(parameters) == 0:
+            return 0
+        self._cursor.executemany(
+            self._backend.translate(statement), parameters
+        )
+        if not self.in_transaction:
+            self._database.commit()
         return self._cursor.rowcount
 
+    def upsert(self, table: str, keys: dict, values: dict,
+            increment: bool = False) -> int:
+        """
+        Insert a row into a table, or update the existing row if one with the
+        same primary key already exists, in a single statement. `keys` and
+        `values` map column names to values, with only the columns in `values`
+        being changed on an existing row. If `increment` is `True`, the values
+        are added to the existing ones instead of replacing them. Returns 0 if
+        the row was left as it was and a non-zero number if it was inserted or
+        changed, as the exact number differs between backends. Table and
+        column names are not escaped, so must never come from user input.
+        """
+        return self.modify(
+            self._backend.upsert_statement(
+                table, list(keys), list(values), increment
+            ),
+            (*keys.values(), *values.values())
+        )
+
+    def upsert_many(self, table: str, key_columns, value_columns, rows,
+            increment: bool = False) -> int:
+        """
+        A bulk version of `upsert`. Each row in `rows` should be a sequence of
+        values for `key_columns` followed by values for `value_columns`.
+        """
+        return self.modify_many(
+            self._backend.upsert_statement(
+                table, list(key_columns), list(value_columns), increment
+            ),
+            rows
+        )
+
+    def begin(self):
+        """
+        Start a transaction. Changes made with `modify` and similar methods
+        will not be committed until `commit` is called.
+        """
+        self._backend.begin(self._database)
+        self.in_transaction = True
+
+    def commit(self):
+        """Commit the current transaction and end it."""
+        self.in_transaction = False
+        self._database.commit()
+
+    def rollback(self):
+        """Discard every change made in the current transaction and end it."""
+        self.in_transaction = False
+        self._database.rollback()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        A context manager that groups every statement inside it into one
+        transaction with a single commit. The transaction is rolled back if an
+        exception is raised. Nested transactions are merged into the
+        outermost one.
+        """
+        if self.in_transaction:
+            yield self
+            return
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
     def close(self):
-        """Close the connection to the database."""
+        """Return the connection to the pool."""
+        if self._database is None:
+            return
         self._cursor.close()
-        self._database.close()
+        self._pool.release(self._database)
+        self._database = None
+
+
+class AsyncDatabase:
+    """
+    An awaitable version of `Database` with asynchronous context manager
+    support. Statements are run on the connection pool's worker threads so
+    that the event loop is never blocked waiting on the database server.
+    """
+    def __init__(self, database_config: ConfigParser):
+        """
+        Prepare to acquire a connection to a database with the details
+        specified in the `DatabaseConnection` section of the config file.
+        The connection is acquired with `open` or by entering the context
+        manager.
+        """
+        self._database_config = database_config
+        self._pool = get_pool(database_config)
+        self._database = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, _, __, ___):
+        await self.close()
+        return False
+
+    async def open(self):
+        """Acquire a connection from the pool."""
+        await self._pool.semaphore.acquire()
+        future = asyncio.ensure_future(
+            self._pool.run(Database, self._database_config)
+        )
+        try:
+            self._database = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The connection will still be acquired by the worker thread, so
+            # it must be given back once that happens.
+            future.add_done_callback(self._release_abandoned)
+            raise
+        except BaseException:
+            self._pool.semaphore.release()
+            raise
+
+    def _release_abandoned(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+        self._pool.semaphore.release()
+
+    async def fetch(self, *args, **kwargs) -> list[tuple]:
+        """
+        Execute an SQL statement and return the result. Designed for statements
+        using `SELECT`.
+        """
+        return await self._pool.run(self._database.fetch, *args, **kwargs)
+
+    async def modify(self, *args, **kwargs) -> int:
+        """
+        Execute an SQL statement and return the number of rows modified.
+        Designed for statements such as `UPDATE`, `INSERT` and `DELETE`.
+        Modifications are automatically committed to the database server.
+        """
+        return await self._pool.run(self._database.modify, *args, **kwargs)
+
+    async def insert(self, *args, **kwargs) -> int:
+        """
+        Execute an SQL `INSERT` statement and return the auto-increment ID of
+        the inserted row.
+        """
+        return await self._pool.run(self._database.insert, *args, **kwargs)
+
+    async def modify_many(self, statement: str, parameters) -> int:
+        """
+        Execute an SQL statement once for every sequence of parameters in
+        `parameters` in a single round trip. See `Database.modify_many`.
+        """
+        return await self._pool.run(
+            self._database.modify_many, statement, parameters
+        )
+
+    async def upsert(self, table: str, keys: dict, values: dict,
+            increment: bool = False) -> int:
+        """
+        Insert a row into a table, or update it if it already exists, in a
+        single statement. Returns 0 if nothing changed, and a non-zero number
+        otherwise. See `Database.upsert`.
+        """
+        return await self._pool.run(
+            self._database.upsert, table, keys, values, increment
+        )
+
+    async def upsert_many(self, table: str, key_columns, value_columns, rows,
+            increment: bool = False) -> int:
+        """A bulk version of `upsert`. See `Database.upsert_many`."""
+        return await self._pool.run(
+            self._database.upsert_many, table, key_columns, value_columns,
+            rows, increment
+        )
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """
+        An asynchronous context manager that groups every statement inside it
+        into one transaction with a single commit. See
+        `Database.transaction`.
+        """
+        if self._database.in_transaction:
+            yield self
+            return
+        await self._pool.run(self._database.begin)
+        try:
+            yield self
+        except BaseException:
+            await asyncio.shield(self._pool.run(self._database.rollback))
+            raise
+        await self._pool.run(self._database.commit)
+
+    async def close(self):
+        """Return the connection to the pool."""
+        if self._database is None:
+            return
+        database = self._database
+        self._database = None
+        try:
+            await asyncio.shield(self._pool.run(database.close))
+        finally:
+            self._pool.semaphore.release()
 
 
-def get_guild_config(database_config: ConfigParser, guild_id: int):
+async def get_guild_config(database_config: ConfigParser, guild_id: int):
     """Get the configuration for a guild with a specified ID."""
-    with Database(database_config) as database:
+    async with AsyncDatabase(database_config) as database:
         try:
-            response = database.fetch(
+            response = (await database.fetch(
                 f"SELECT {','.join(GuildConfig._fields)} FROM guild_config "
                 + "WHERE guild_id = %s;", (guild_id,)
-            )[0]
+            ))[0]
         except IndexError:
             return GuildConfig()
     return GuildConfig(*response)
 
 
+def _split_sql_statements(sql: str):
+    sql = "\n".join(
+        x for x in sql.splitlines() if not x.lstrip().startswith("--")
+    )
+    return [x.strip() for x in re.split(r";\s*$", sql, flags=re.M)
+            if x.strip() != ""]
+
+
+def run_migrations(database_config: ConfigParser, namespace: str,
+        directory: str):
+    """
+    Apply every SQL migration in `directory` that has not yet been applied to
+    the database, recording each one in the `schema_migrations` table.
+    Migration files should be named `<version>_<description>.sql`, where
+    version is a number, and are applied in ascending order of version.
+    Versions are tracked separately for each `namespace`, so plugins can
+    ship migrations without conflicting with each other. Statements in a file
+    must each end with a semicolon at the end of a line. Most schema changes
+    cannot be rolled back, so migrations should be written to be safely
+    re-run if one fails part way through. When using the SQLite backend,
+    migrations are read from the `sqlite` subdirectory of `directory` if it
+    exists. Returns the names of the files that were applied.
+    """
+    directory = get_backend(database_config).migrations_directory(directory)
+    migrations = []
+    for file_name in os.listdir(directory):
+        match = re.fullmatch(r"(\d+)_.*\.sql", file_name)
+        if match is not None:
+            migrations.append((int(match.group(1)), file_name))
+    migrations.sort()
+    applied = []
+    with Database(database_config) as database:
+        database.modify(
+            "CREATE TABLE IF NOT EXISTS `schema_migrations` ("
+            + "`namespace` varchar(64) NOT NULL, "
+            + "`version` int(11) NOT NULL, "
+            + "`name` varchar(255) NOT NULL, "
+            + "`applied_at` datetime NOT NULL, "
+            + "PRIMARY KEY (`namespace`, `version`));"
+        )
+        applied_versions = {
+            x[0] for x in database.fetch(
+                "SELECT version FROM schema_migrations WHERE namespace = %s;",
+                (namespace,)
+            )
+        }
+        for version, file_name in migrations:
+            if version in applied_versions:
+                continue
+            with open(os.path.join(directory, file_name),
+                    encoding="utf8") as file:
+                statements = _split_sql_statements(file.read())
+            with database.transaction():
+                for statement in statements:
+                    database.modify(statement)
+                database.modify(
+                    "INSERT INTO schema_migrations "
+                    + "(namespace, version, name, applied_at) "
+                    + "VALUES (%s, %s, %s, %s);",
+                    (namespace, version, file_name, datetime.datetime.now())
+                )
+            applied.append(file_name)
+    return applied
+
+
+class GuildConfigCache:
+    """
+    An in-memory cache of `GuildConfig` tuples, designed for use with
+    PhotonBot. Entries are kept for `ttl` seconds, after which the cached value
+    continues to be returned while it is refreshed from the database in the
+    background. Anything that writes to the `guild_config` table should
+    update or invalidate the cache afterwards.
+    """
+    def __init__(self, database_config: ConfigParser, ttl: float = 300.0):
+        """
+        Create an empty cache that loads from the database specified in the
+        `DatabaseConnection` section of the config file.
+        """
+        self._database_config = database_config
+        self.ttl = ttl
+        # Guild IDs map to the cached config and the time it expires
+        self._entries = {}
+        self._refreshing = {}
+        self._hits = 0
+        self._misses = 0
+        self._refreshes = 0
+
+    async def warm(self, guild_ids):
+        """
+        Load the configuration for every guild in `guild_ids` with a single
+        query. Guilds without a row in the database are cached with the
+        default configuration.
+        """
+        async with AsyncDatabase(self._database_config) as database:
+            response = await database.fetch(
+                f"SELECT guild_id,{','.join(GuildConfig._fields)} "
+                + "FROM guild_config;"
+            )
+        expiry = time.monotonic() + self.ttl
+        for guild_id in guild_ids:
+            self._entries[guild_id] = (GuildConfig(), expiry)
+        for guild_id, *guild_config in response:
+            self._entries[guild_id] = (GuildConfig(*guild_config), expiry)
+
+    async def get(self, guild_id: int):
+        """
+        Get the configuration for a guild with a specified ID. The database is
+        only queried if the guild has never been cached.
+        """
+        entry = self._entries.get(guild_id)
+        if entry is None:
+            self._misses += 1
+            return await self.refresh(guild_id)
+        self._hits += 1
+        if entry[1] <= time.monotonic() and guild_id not in self._refreshing:
+            task = asyncio.ensure_future(self.refresh(guild_id))
+            self._refreshing[guild_id] = task
+            task.add_done_callback(
+                lambda task: self._refresh_done(guild_id, task)
+            )
+        return entry[0]
+
+    def _refresh_done(self, guild_id: int, task: asyncio.Task):
+        del self._refreshing[guild_id]
+        if not task.cancelled() and task.exception() is not None:
+            print(
+                f"Failed to refresh config for guild {guild_id}: "
+                + str(task.exception())
+            )
+
+    async def refresh(self, guild_id: int):
+        """
+        Reload the configuration for a guild from the database. If the cache
+        is written to while the database is being read, the newer value is
+        kept instead.
+        """
+        previous = self._entries.get(guild_id)
+        guild_config = await get_guild_config(self._database_config, guild_id)
+        self._refreshes += 1
+        current = self._entries.get(guild_id)
+        if current is previous:
+            self.set(guild_id, guild_config)
+        elif current is not None:
+            return current[0]
+        return guild_config
+
+    def set(self, guild_id: int, guild_config: GuildConfig):
+        """Replace the cached configuration for a guild."""
+        self._entries[guild_id] = (guild_config, time.monotonic() + self.ttl)
+
+    def update(self, guild_id: int, **changes):
+        """
+        Change individual fields of the cached configuration for a guild.
+        If the guild is not cached, it will be loaded from the database the
+        next time it is requested.
+        """
+        entry = self._entries.get(guild_id)
+        if entry is None:
+            return
+        self.set(guild_id, entry[0]._replace(**changes))
+
+    def invalidate(self, guild_id: int):
+        """
+        Remove a guild from the cache so that it will be loaded from the
+        database the next time it is requested.
+        """
+        self._entries.pop(guild_id, None)
+
+    def stats(self):
+        """Get the number of cached guilds and how often the cache was hit."""
+        return {
+            "entries": len(self._entries),
+            "hits": self._hits,
+            "misses": self._misses,
+            "refreshes": self._refreshes
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into a single call, designed
+    for wrapping requests to third-party APIs. While a call for a key is in
+    progress, every other caller asking for that key waits for its result
+    instead of making its own. Results are not kept once the call finishes;
+    use `TTLCache` for that.
+    """
+    def __init__(self):
+        """Create a helper with no calls in progress."""
+        self._flights = {}
+        self._calls = 0
+        self._shared = 0
+
+    async def run(self, key, fetch):
+        """
+        Await `fetch()` and return its result, or wait for the result of the
+        call already in progress for `key`. Exceptions are raised to every
+        waiting caller. Cancelling one caller does not cancel the call for the
+        others.
+        """
+        self._calls += 1
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._flights[key] = task
+            task.add_done_callback(lambda task: self._done(key, task))
+        else:
+            self._shared += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            # Stops the exception being reported as never retrieved if every
+            # caller was cancelled
+            task.exception()
+
+    def stats(self):
+        """Get the number of calls in progress and how many were shared."""
+        return {
+            "in_flight": len(self._flights),
+            "calls": self._calls,
+            "shared": self._shared
+        }
+
+
+class TTLCache:
+    """
+    An in-memory cache of the results of coroutine functions, such as
+    responses from third-party APIs. Each entry is fresh for `ttl` seconds,
+    then stale for a further `stale_ttl` seconds, during which the stale value
+    continues to be returned while it is refreshed in the background. Entries
+    older than that are fetched again before being returned. The least
+    recently used entries are removed once there are more than `max_entries`.
+    Exceptions raised while fetching are never cached, nor are values that
+    `cache_if` returns false for. Concurrent fetches for the same key are
+    coalesced with a `SingleFlight`.
+    """
+    def __init__(self, max_entries: int = 1024):
+        """Create an empty cache."""
+        self.max_entries = max_entries
+        # Keys map to the cached value, the time it goes stale, and the time
+        # it can no longer be returned
+        self._entries = collections.OrderedDict()
+        self._refreshing = {}
+        self._flights = SingleFlight()
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    async def get(self, key, fetch, ttl: float, stale_ttl: float = None,
+            cache_if=None):
+        """
+        Get the cached value for `key`, awaiting `fetch()` to get it if it is
+        not cached. `stale_ttl` defaults to `ttl`. If `cache_if` is given, a
+        fetched value is only cached if `cache_if(value)` is true, otherwise
+        it is returned without replacing what is already cached.
+        """
+        if stale_ttl is None:
+            stale_ttl = ttl
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is None or entry[2] <= now:
+            self._misses += 1
+            return await self._fetch(key, fetch, ttl, stale_ttl, cache_if)
+        self._entries.move_to_end(key)
+        if entry[1] <= now:
+            self._stale_hits += 1
+            if key not in self._refreshing:
+                task = asyncio.ensure_future(
+                    self._fetch(key, fetch, ttl, stale_ttl, cache_if)
+                )
+                self._refreshing[key] = task
+                task.add_done_callback(
+                    lambda task: self._refresh_done(key, task)
+                )
+        else:
+            self._hits += 1
+        return entry[0]
+
+    def _refresh_done(self, key, task: asyncio.Task):
+        del self._refreshing[key]
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Failed to refresh cache entry {key}: {task.exception()}")
+
+    async def _fetch(self, key, fetch, ttl: float, stale_ttl: float,
+            cache_if):
+        async def fetch_and_set():
+            value = await fetch()
+            if cache_if is None or cache_if(value):
+                self.set(key, value, ttl, stale_ttl)
+            return value
+        return await self._flights.run(key, fetch_and_set)
+
+    def set(self, key, value, ttl: float, stale_ttl: float = None):
+        """Replace the cached value for `key`."""
+        if stale_ttl is None:
+            stale_ttl = ttl
+        now = time.monotonic()
+        self._entries[key] = (value, now + ttl, now + ttl + stale_ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def peek(self, key):
+        """
+        Get the cached value for `key` even if it has expired, or `None` if
+        it is not cached, such as to use when it cannot be fetched again.
+        """
+        entry = self._entries.get(key)
+        return None if entry is None else entry[0]
+
+    def invalidate(self, key):
+        """Remove an entry so that it is fetched the next time it is used."""
+        self._entries.pop(key, None)
+
+    def stats(self):
+        """Get the number of cached entries and how often the cache was hit."""
+        return {
+            "entries": len(self._entries),
+            "hits": self._hits,
+            "stale_hits": self._stale_hits,
+            "misses": self._misses,
+            "coalesced": self._flights.stats()["shared"],
+            "evictions": self._evictions
+        }
+
+
 def single_level_exp(level: int):
     """
     Get the amount of EXP needed to progress to a level from the previous one.
@@ -90,34 +1054,82 @@ def single_level_exp(level: int):
     return 5 * level ** 2 + 50 * level + 100
 
 
+def total_exp_for_level(level: int):
+    """Calculate the minimum EXP required for a particular level."""
+    if level <= 0:
+        return 0
+    # Closed form of the sum of `single_level_exp` from 1 to `level`
+    return (
+        5 * level * (level + 1) * (2 * level + 1) // 6
+        + 25 * level * (level + 1) + 100 * level
+    )
+
+
+# Cumulative EXP needed for every level up to MAX_TABLE_LEVEL, which covers
+# the maximum amount of EXP that can be given with /expedit
+MAX_TABLE_LEVEL = 1000
+_LEVEL_TABLE = [total_exp_for_level(x) for x in range(MAX_TABLE_LEVEL + 1)]
+_LEVEL_TABLE_ARRAY = numpy.array(_LEVEL_TABLE, dtype=numpy.int64)
+
+
 def calculate_level(exp: int):
     """
     Calculate a user's level based off of the amount of EXP they have.
     Also returns the amount of "excess" EXP the user has progressing them
     toward the next level.
     """
-    remainder = exp
-    level = 0
-    while remainder >= single_level_exp(level + 1):
-        level += 1
-        remainder -= single_level_exp(level)
-    return level, remainder
+    if exp < _LEVEL_TABLE[-1]:
+        level = max(bisect.bisect_right(_LEVEL_TABLE, exp) - 1, 0)
+    else:
+        # Estimate from the leading cubic term, then correct exactly
+        level = int((0.6 * exp) ** (1 / 3))
+        while total_exp_for_level(level + 1) <= exp:
+            level += 1
+        while total_exp_for_level(level) > exp:
+            level -= 1
+    return level, exp - total_exp_for_level(level)
 
 
-def total_exp_for_level(level: int):
-    """Calculate the minimum EXP required for a particular level."""
-    return sum(single_level_exp(x) for x in range(1, level + 1))
+def calculate_levels(exps):
+    """
+    A vectorised version of `calculate_level` that takes an array-like of EXP
+    values and returns a NumPy array of levels and a NumPy array of "excess"
+    EXP.
+    """
+    exps = numpy.asarray(exps, dtype=numpy.int64)
+    levels = numpy.maximum(
+        numpy.searchsorted(_LEVEL_TABLE_ARRAY, exps, side="right") - 1, 0
+    )
+    beyond_table = exps >= _LEVEL_TABLE[-1]
+    if beyond_table.any():
+        levels[beyond_table] = [
+            calculate_level(int(x))[0] for x in exps[beyond_table]
+        ]
+    return levels, exps - total_exp_for_levels(levels)
+
 
+def total_exp_for_levels(levels):
+    """
+    A vectorised version of `total_exp_for_level` that takes an array-like of
+    levels and returns a NumPy array of the minimum EXP required for each.
+    """
+    levels = numpy.maximum(numpy.asarray(levels, dtype=numpy.int64), 0)
+    return (
+        5 * levels * (levels + 1) * (2 * levels + 1) // 6
+        + 25 * levels * (levels + 1) + 100 * levels
+    )
 
-def get_exp_info(database_config: ConfigParser, guild_id: int, user_id: int):
+
+async def get_exp_info(database_config: ConfigParser, guild_id: int,
+        user_id: int):
     """
     Get a user's EXP in a particular guild.
     Also calculates level, amount of EXP gained toward the next level,
     numeric rank compared to other guild members, EXP needed to progress from
     the current level to the next, and rank card color.
     """
-    with Database(database_config) as database:
-        exp_response = database.fetch(
+    async with AsyncDatabase(database_config) as database:
+        exp_response = await database.fetch(
             "SELECT exp FROM user_exp WHERE guild_id = %s AND user_id = %s;",
             (guild_id, user_id)
         )
@@ -126,11 +1138,11 @@ def get_exp_info(database_config: ConfigParser, guild_id: int, user_id: int):
         else:
             exp = exp_response[0][0]
         level, remaining = calculate_level(exp)
-        rank = database.fetch(
+        rank = (await database.fetch(
             "SELECT COUNT(*) FROM user_exp WHERE guild_id = %s AND exp >= %s;",
             (guild_id, exp)
-        )[0][0]
-        card_response = database.fetch(
+        ))[0][0]
+        card_response = await database.fetch(
             "SELECT red, green, blue FROM user_exp_card WHERE user_id = %s;",
             (user_id,)
         )
@@ -141,3 +1153,373 @@ def get_exp_info(database_config: ConfigParser, guild_id: int, user_id: int):
     return ExpInfo(
         exp, level, remaining, rank, single_level_exp(level + 1), color
     )
+
+
+class CooldownStore:
+    """
+    A store of cooldowns that all last the same number of seconds, keyed by
+    any hashable value. Expired cooldowns are evicted whenever a new one is
+    started, so memory use is proportional to the number of cooldowns started
+    within the last `duration` seconds.
+    """
+    def __init__(self, duration: float):
+        """Create an empty store of cooldowns lasting `duration` seconds."""
+        self.duration = duration
+        # Keys map to the monotonic time their cooldown ends. As every
+        # cooldown is the same length, insertion order is also expiry order.
+        self._expiries = collections.OrderedDict()
+        self._evictions = 0
+
+    def _evict_expired(self, now: float):
+        while len(self._expiries) > 0:
+            key = next(iter(self._expiries))
+            if self._expiries[key] > now:
+                break
+            del self._expiries[key]
+            self._evictions += 1
+
+    def try_start(self, key):
+        """
+        Start a cooldown for `key` if one is not already active. Returns `True`
+        if a new cooldown was started, or `False` if one was already active.
+        """
+        now = time.monotonic()
+        self._evict_expired(now)
+        if key in self._expiries:
+            return False
+        self._expiries[key] = now + self.duration
+        return True
+
+    def stats(self):
+        """Get the number of active cooldowns and how many have expired."""
+        return {
+            "entries": len(self._expiries),
+            "evictions": self._evictions
+        }
+
+
+class RankIndex:
+    """
+    A sorted in-memory index of user EXP for each guild. Finding the rank of an
+    amount of EXP takes logarithmic time in the number of users in the guild.
+    """
+    def __init__(self):
+        """Create an index with no guilds loaded."""
+        # Guild IDs map to a list of (exp, user_id) tuples in ascending order
+        # and a dictionary of the current EXP of each user
+        self._sorted = {}
+        self._exp = {}
+
+    def load_guild(self, guild_id: int, exp: dict):
+        """
+        Replace the contents of the index for a guild with a dictionary
+        mapping user IDs to their EXP.
+        """
+        self._exp[guild_id] = dict(exp)
+        self._sorted[guild_id] = sorted(
+            (user_exp, user_id) for user_id, user_exp in exp.items()
+        )
+
+    def is_loaded(self, guild_id: int):
+        """Whether a guild has been loaded into the index."""
+        return guild_id in self._sorted
+
+    def loaded_guilds(self):
+        """Get a list of the IDs of every guild loaded into the index."""
+        return list(self._sorted)
+
+    def get_exp(self, guild_id: int, user_id: int):
+        """
+        Get the EXP of a user in a loaded guild. Users not in the index have 0
+        EXP.
+        """
+        return self._exp[guild_id].get(user_id, 0)
+
+    def update(self, guild_id: int, user_id: int, exp: int):
+        """Set the EXP of a user in a loaded guild."""
+        guild_sorted = self._sorted[guild_id]
+        old_exp = self._exp[guild_id].get(user_id)
+        if old_exp is not None:
+            del guild_sorted[bisect.bisect_left(
+                guild_sorted, (old_exp, user_id)
+            )]
+        bisect.insort(guild_sorted, (exp, user_id))
+        self._exp[guild_id][user_id] = exp
+
+    def rank(self, guild_id: int, exp: int):
+        """
+        Get the number of users in a loaded guild with at least the given
+        amount of EXP.
+        """
+        guild_sorted = self._sorted[guild_id]
+        return len(guild_sorted) - bisect.bisect_left(guild_sorted, (exp,))
+
+    def size(self, guild_id: int):
+        """Get the number of users in a loaded guild."""
+        return len(self._sorted[guild_id])
+
+    def position(self, guild_id: int, key: tuple):
+        """
+        Get the number of users in a loaded guild that are ranked above an
+        `(exp, user_id)` key. Users with the same EXP are ordered by
+        descending user ID.
+        """
+        guild_sorted = self._sorted[guild_id]
+        return len(guild_sorted) - bisect.bisect_right(guild_sorted, key)
+
+    def page(self, guild_id: int, count: int, after: tuple = None,
+            before: tuple = None):
+        """
+        Get up to `count` (user_id, exp) tuples from a loaded guild in
+        descending order of EXP, using keyset pagination. If `after` is given,
+        the page contains the users ranked directly below that
+        `(exp, user_id)` key, and if `before` is given, those ranked directly
+        above it. Otherwise, the top users are returned. Unlike paging by
+        position, users are never skipped or repeated between pages if EXP
+        changes while paging, and each page takes logarithmic time to find.
+        """
+        guild_sorted = self._sorted[guild_id]
+        if before is not None:
+            start = bisect.bisect_right(guild_sorted, before)
+            end = start + count
+        else:
+            end = len(guild_sorted) if after is None else bisect.bisect_left(
+                guild_sorted, after
+            )
+            start = max(end - count, 0)
+        return [
+            (user_id, exp)
+            for exp, user_id in reversed(guild_sorted[start:end])
+        ]
+
+    def page_at(self, guild_id: int, position: int, count: int):
+        """
+        Get up to `count` (user_id, exp) tuples from a loaded guild in
+        descending order of EXP, starting at a 0-based position.
+        """
+        guild_sorted = self._sorted[guild_id]
+        end = max(len(guild_sorted) - position, 0)
+        return [
+            (user_id, exp)
+            for exp, user_id in reversed(
+                guild_sorted[max(end - count, 0):end]
+            )
+        ]
+
+    def stats(self):
+        """Get the number of guilds and users in the index."""
+        return {
+            "guilds": len(self._sorted),
+            "users": sum(len(x) for x in self._sorted.values())
+        }
+
+
+class ExpLedger:
+    """
+    An in-memory record of user EXP, designed for use with PhotonBot.
+    The EXP of every user in a guild is loaded into a `RankIndex` the first
+    time it is needed, or all at once with `reconcile`. Grants are applied to
+    the index immediately, while the changes they make are accumulated per
+    guild and written to the database in bulk whenever `flush` is called.
+    The database remains the source of truth, with `reconcile` reloading the
+    index from it.
+    """
+    def __init__(self, database_config: ConfigParser):
+        """
+        Create an empty ledger backed by the database specified in the
+        `DatabaseConnection` section of the config file.
+        """
+        self._database_config = database_config
+        self.rank_index = RankIndex()
+        # Maps guild IDs to dictionaries of user IDs to EXP not yet written to
+        # the database
+        self._pending = {}
+        self._loading = {}
+        self._flush_lock = asyncio.Lock()
+        self._grants = 0
+        self._flushes = 0
+        self._rows_flushed = 0
+        self._reconciles = 0
+
+    async def _ensure_loaded(self, guild_id: int):
+        if self.rank_index.is_loaded(guild_id):
+            return
+        # Concurrent callers share a single load of the guild
+        task = self._loading.get(guild_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load_guild(guild_id))
+            self._loading[guild_id] = task
+            task.add_done_callback(
+                lambda _: self._loading.pop(guild_id, None)
+            )
+        await asyncio.shield(task)
+
+    async def _load_guild(self, guild_id: int):
+        async with AsyncDatabase(self._database_config) as database:
+            guild_response = await database.fetch(
+                "SELECT user_id, exp FROM user_exp WHERE guild_id = %s;",
+                (guild_id,)
+            )
+        # The guild may have been loaded by `reconcile` in the meantime
+        if not self.rank_index.is_loaded(guild_id):
+            self.rank_index.load_guild(guild_id, dict(guild_response))
+
+    async def get_exp(self, guild_id: int, user_id: int):
+        """
+        Get the current amount of EXP a user has in a guild, including any
+        grants that have not yet been flushed.
+        """
+        await self._ensure_loaded(guild_id)
+        return self.rank_index.get_exp(guild_id, user_id)
+
+    async def get_exp_info(self, guild_id: int, user_id: int):
+        """
+        The equivalent of `get_exp_info` that takes EXP and rank from memory,
+        so only the rank card color is read from the database.
+        """
+        async with AsyncDatabase(self._database_config) as database:
+            card_response = await database.fetch(
+                "SELECT red, green, blue FROM user_exp_card "
+                + "WHERE user_id = %s;", (user_id,)
+            )
+        if len(card_response) == 0:
+            color = (None,) * 3
+        else:
+            color = card_response[0]
+        exp = await self.get_exp(guild_id, user_id)
+        level, remaining = calculate_level(exp)
+        return ExpInfo(
+            exp, level, remaining, self.rank_index.rank(guild_id, exp),
+            single_level_exp(level + 1), color
+        )
+
+    async def page(self, guild_id: int, count: int, after: tuple = None,
+            before: tuple = None, position: int = None):
+        """
+        Get a page of the EXP leaderboard for a guild as a list of
+        (user_id, exp) tuples, along with the 0-based position of the first
+        user on it. Pages are found either with an `(exp, user_id)` key
+        `after` or `before` them, see `RankIndex.page`, or by `position`.
+        """
+        await self._ensure_loaded(guild_id)
+        if position is not None:
+            rows = self.rank_index.page_at(guild_id, position, count)
+        else:
+            rows = self.rank_index.page(guild_id, count, after, before)
+        if len(rows) == 0:
+            return position or 0, rows
+        return self.rank_index.position(
+            guild_id, (rows[0][1], rows[0][0])
+        ), rows
+
+    async def position(self, guild_id: int, user_id: int):
+        """
+        Get the 0-based position of a user on the EXP leaderboard for a guild.
+        """
+        exp = await self.get_exp(guild_id, user_id)
+        return self.rank_index.position(guild_id, (exp, user_id))
+
+    async def size(self, guild_id: int):
+        """Get the number of users with EXP in a guild."""
+        await self._ensure_loaded(guild_id)
+        return self.rank_index.size(guild_id)
+
+    async def grant(self, guild_id: int, user_id: int, amount: int):
+        """
+        Give a user an amount of EXP in a guild. The change is not written to
+        the database until the next flush. Returns the user's EXP from before
+        and after the grant.
+        """
+        old_exp = await self.get_exp(guild_id, user_id)
+        self.rank_index.update(guild_id, user_id, old_exp + amount)
+        guild_pending = self._pending.setdefault(guild_id, {})
+        guild_pending[user_id] = guild_pending.get(user_id, 0) + amount
+        self._grants += 1
+        return old_exp, old_exp + amount
+
+    async def set_exp(self, guild_id: int, user_id: int, exp: int):
+        """
+        Overwrite the amount of EXP a user has in a guild. Unlike `grant`, the
+        new value is written to the database immediately.
+        """
+        await self._ensure_loaded(guild_id)
+        async with self._flush_lock:
+            self.rank_index.update(guild_id, user_id, exp)
+            self._pending.get(guild_id, {}).pop(user_id, None)
+            async with AsyncDatabase(self._database_config) as database:
+                await database.upsert(
+                    "user_exp", {"guild_id": guild_id, "user_id": user_id},
+                    {"exp": exp}
+                )
+
+    async def flush(self):
+        """
+        Write all accumulated EXP changes to the database in a single bulk
+        statement. If the write fails, the changes are kept for the next
+        flush. Returns the number of users written.
+        """
+        async with self._flush_lock:
+            return await self._flush()
+
+    async def _flush(self):
+        pending = self._pending
+        self._pending = {}
+        rows = [
+            (guild_id, user_id, amount)
+            for guild_id, guild_pending in pending.items()
+            for user_id, amount in guild_pending.items() if amount != 0
+        ]
+        if len(rows) == 0:
+            return 0
+        try:
+            async with AsyncDatabase(self._database_config) as database:
+                await database.upsert_many(
+                    "user_exp", ("guild_id", "user_id"), ("exp",), rows,
+                    increment=True
+                )
+        except BaseException:
+            for guild_id, user_id, amount in rows:
+                guild_pending = self._pending.setdefault(guild_id, {})
+                guild_pending[user_id] = guild_pending.get(user_id, 0) + amount
+            raise
+        self._flushes += 1
+        self._rows_flushed += len(rows)
+        return len(rows)
+
+    async def reconcile(self, guild_ids=None):
+        """
+        Flush any accumulated changes, then reload the index from the
+        database with a single query. Guilds in `guild_ids` are loaded as
+        well as every guild that is already in the index.
+        """
+        async with self._flush_lock:
+            await self._flush()
+            guilds = {x: {} for x in self.rank_index.loaded_guilds()}
+            guilds.update({x: {} for x in guild_ids or ()})
+            if len(guilds) == 0:
+                return
+            async with AsyncDatabase(self._database_config) as database:
+                exp_response = await database.fetch(
+                    "SELECT guild_id, user_id, exp FROM user_exp;"
+                )
+            for guild_id, user_id, exp in exp_response:
+                if guild_id in guilds:
+                    guilds[guild_id][user_id] = exp
+            for guild_id, guild_exp in guilds.items():
+                # Grants made while the database was being read are not in
+                # the response, but are still pending
+                for user_id, amount in self._pending.get(guild_id, {}).items():
+                    guild_exp[user_id] = guild_exp.get(user_id, 0) + amount
+                self.rank_index.load_guild(guild_id, guild_exp)
+            self._reconciles += 1
+
+    def stats(self):
+        """Get the number of grants made and how many have been flushed."""
+        return {
+            **self.rank_index.stats(),
+            "pending_users": sum(len(x) for x in self._pending.values()),
+            "grants": self._grants,
+            "flushes": self._flushes,
+            "rows_flushed": self._rows_flushed,
+            "reconciles": self._reconciles
+        }